@@ -0,0 +1,196 @@
+"""Benchmark: lexing throughput of each language, written as JSON.
+
+python benchmark.py [--size KB] [--repeat N] [--engines simple,regex,dfa]
+                    [--languages lua,python] [--corpus lua=file.lua]
+                    [--output result.json] [--compare old.json]
+                    [--import-budget MS]
+"""
+
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import weyland
+from weyland import Lexer, LANGUAGES
+
+# Lines assembled at random to make a corpus for each language
+LINES = {
+    'ash': [
+        'if a then\n',
+        '  b = 2..3 + 4.5 * c\n',
+        'else\n',
+        '  s = "str" -- comment\n',
+        'end\n',
+        'x = (a, b) -- other comment\n',
+        'flag = true\n',
+        'y = nil\n',
+    ],
+    'game': [
+        'Total Annihilation: Half-life 2\n',
+        "Baldur's Gate 12\n",
+        'FarCry: Doom Quake 3\n',
+    ],
+    'hamill': [
+        'var x : 12\n',
+        'const css : true\n',
+        '{ a . b # c }\n',
+        '§§ note\n',
+        'include html\n',
+    ],
+    'lua': [
+        'local x = 12 + y -- comment here\n',
+        'function f(a, b)\n',
+        '  return a .. "str\\n" .. b\n',
+        'end\n',
+        't = { ["k"] = 5.5, 3 }\n',
+        'print(t.k)\n',
+        'for i, v in ipairs(t) do x = x + i end\n',
+        '--[[ multiline\ncomment --]]\n',
+    ],
+    'python': [
+        'def foo(a, b):\n',
+        '    if a >= b and not c:\n',
+        '        return a ** 2 // 3\n',
+        '    x = [1, 2.5, "s"]  # comment\n',
+        '    while True:\n',
+        '        pass\n',
+        'class Foo(Bar):\n',
+        '    y = {"k": None, \'v\': False}\n',
+    ],
+    'text': [
+        'Lorem ipsum dolor sit amet,\tconsectetur adipiscing elit.\n',
+        'Sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.\n',
+        '\n',
+    ],
+}
+
+
+def make_corpus(name, size, seed=0):
+    """Return a text of about size characters for the language."""
+    rand = random.Random(seed)
+    lines = [line for line in LINES[name] if '--[[' not in line]
+    parts = []
+    length = 0
+    while length < size:
+        line = rand.choice(lines)
+        parts.append(line)
+        length += len(line)
+    # The Lua multiline comment takes all the text after it, it is put at the end
+    parts.extend(line for line in LINES[name] if '--[[' in line)
+    return ''.join(parts)
+
+
+def measure(function, text, repeat):
+    """Return the best time of repeat runs, the number of tokens and the peak of memory."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(text)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    tracemalloc.start()
+    function(text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, result, peak
+
+
+def measure_import(repeat):
+    """Return the best cumulative time in microseconds of import weyland, from python -X importtime."""
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import weyland'],
+                                capture_output=True, text=True, check=True)
+        for line in result.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == 'weyland':
+                duration = int(fields[1])
+                best = duration if best is None else min(best, duration)
+    return best
+
+
+def run(names, engines, size, repeat, corpora):
+    results = []
+    for name in names:
+        text = corpora[name] if name in corpora else make_corpus(name, size)
+        megabytes = len(text.encode('utf8')) / 2**20
+        for engine in engines:
+            lexer = Lexer(LANGUAGES[name], [], engine)
+            tokens = lexer.lex(text)
+            for operation, function in [('lex', lexer.lex), ('to_html', lambda t: lexer.to_html(text=t))]:
+                duration, _, peak = measure(function, text, repeat)
+                results.append({
+                    'language': name,
+                    'engine': engine,
+                    'operation': operation,
+                    'characters': len(text),
+                    'tokens': len(tokens),
+                    'seconds': duration,
+                    'tokens_per_second': len(tokens) / duration,
+                    'mb_per_second': megabytes / duration,
+                    'peak_memory': peak,
+                })
+    return {
+        'weyland': weyland.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'import_microseconds': measure_import(repeat),
+        'results': results,
+    }
+
+
+def compare(old, new):
+    """Print the ratio new/old of the throughput for each measure found in both."""
+    if 'import_microseconds' in old:
+        print(f"import weyland: {old['import_microseconds']} us -> {new['import_microseconds']} us")
+    previous = {(r['language'], r['engine'], r['operation']): r for r in old['results']}
+    print(f"{'language':10s} {'engine':8s} {'operation':10s} {'old tok/s':>12s} {'new tok/s':>12s} {'ratio':>6s}")
+    for r in new['results']:
+        key = (r['language'], r['engine'], r['operation'])
+        if key in previous:
+            before = previous[key]['tokens_per_second']
+            print(f"{key[0]:10s} {key[1]:8s} {key[2]:10s} {before:12.0f} {r['tokens_per_second']:12.0f} "
+                  f"{r['tokens_per_second'] / before:6.2f}")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the weyland lexer')
+    parser.add_argument('--size', type=int, default=100, help='size of the generated corpora in KB')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs, the best is kept')
+    parser.add_argument('--engines', default=','.join(Lexer.ENGINES))
+    parser.add_argument('--languages', default=','.join(LINES))
+    parser.add_argument('--corpus', action='append', default=[], help='language=file to use instead of a generated corpus')
+    parser.add_argument('--output', help='file for the JSON result, default to the standard output')
+    parser.add_argument('--compare', help='JSON result of a previous run to compare with')
+    parser.add_argument('--import-budget', type=float, help='fail if import weyland takes more milliseconds')
+    options = parser.parse_args(args)
+    corpora = {}
+    for corpus in options.corpus:
+        name, path = corpus.split('=', 1)
+        with open(path, mode='r', encoding='utf8') as f:
+            corpora[name] = f.read()
+    result = run(options.languages.split(','), options.engines.split(','), options.size * 1024,
+                 options.repeat, corpora)
+    if options.output is None:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        with open(options.output, mode='w', encoding='utf8') as f:
+            json.dump(result, f, indent=2)
+    if options.compare is not None:
+        with open(options.compare, mode='r', encoding='utf8') as f:
+            compare(json.load(f), result)
+    if options.import_budget is not None and result['import_microseconds'] > options.import_budget * 1000:
+        print(f"import weyland took {result['import_microseconds'] / 1000:.1f} ms, "
+              f"more than the budget of {options.import_budget} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
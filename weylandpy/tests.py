@@ -1,3 +1,743 @@
-import weyland
-
-weyland.tests(True)
+"""Tests of the lexer: python tests.py"""
+
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from weyland import Lexer, Language, LANGUAGES, set_cache_directory, lex_many, to_html_many, LexingException, LexingLimitException, LexerStats, LexerCache, Token, CharOffsets, LineIndex, LineLexer, ln
+from weyland.lexer import WORKER_LEXERS
+from weyland.server import Server
+
+#-------------------------------------------------------------------------------
+# Classes
+#-------------------------------------------------------------------------------
+
+class Test:
+
+    def __init__(self, lexer, text, result):
+        self.lexer = lexer
+        self.text = text
+        self.result = result
+        if self.result is None:
+            raise Exception(f"No expected results for test {text}")
+
+    def test(self, num=0, debug=False):
+        tokens = self.lexer.lex(self.text, None, debug)
+        if len(tokens) != len(self.result):
+            longuest = max(len(tokens), len(self.result))
+            print("index expected        type            valeur")
+            for index in range(longuest):
+                if index < len(tokens) and index < len(self.result):
+                    print(f"{index:5d} {self.result[index]:15s} {tokens[index].get_type():15s} {ln(tokens[index].get_value())}")
+                elif index < len(tokens):
+                    print(f"{index:5d} None            {tokens[index].get_type():15s} {ln(tokens[index].get_value())}")
+                elif index < len(self.result):
+                    print(index, self.result[index], 'None')
+            raise Exception(f"Error: expected {len(self.result)} tokens and got {len(tokens)}")
+        for index, r in enumerate(self.result):
+            if tokens[index].get_type() != r:
+                raise LexingException(f"Error: expected {r} and got {tokens[index].get_type()} in {self.text}")
+        print(f"[SUCCESS] Test n°{num} Lang : {self.lexer.get_language()}\nText : |{ln(self.text)}|\nResult:")
+        for tok in tokens:
+            print(f'   {tok}')
+
+
+class TestViews:
+    """Check that the views and spans of the tokens give the same tokens as lex."""
+
+    def __init__(self, lexer, text):
+        self.lexer = lexer
+        self.text = text
+
+    def test(self, num=0, debug=False):
+        tokens = self.lexer.lex(self.text)
+        views = self.lexer.lex_views(self.text)
+        if [view.to_token() for view in views] != tokens:
+            raise Exception(f"Error: the views are not the tokens for {self.text}")
+        spans = [(token.get_type(), token.get_start(), token.get_start() + len(token.get_value())) for token in tokens]
+        if list(self.lexer.iter_spans(self.text)) != spans:
+            raise Exception(f"Error: the spans are not the tokens for {self.text}")
+        print(f"[SUCCESS] Test n°{num} Lang : {self.lexer.get_language()} views of |{ln(self.text)}|")
+
+
+class TestBytes:
+    """Check that the text encoded in UTF-8 gives the same tokens, with byte offsets."""
+
+    def __init__(self, lexer, text):
+        self.lexer = lexer
+        self.text = text
+
+    def test(self, num=0, debug=False):
+        tokens = self.lexer.lex(self.text)
+        data = self.text.encode('utf8')
+        offsets = CharOffsets(data, 4)
+        decoded = [Token(token.get_type(), token.get_value().decode('utf8'), offsets.get(token.get_start()))
+                   for token in self.lexer.lex(data)]
+        if decoded != tokens:
+            raise Exception(f"Error: the tokens of the bytes are not the tokens of {self.text}")
+        print(f"[SUCCESS] Test n°{num} Lang : {self.lexer.get_language()} bytes of |{ln(self.text)}|")
+
+
+class TestStats:
+    """Check that the statistics count all the tokens and characters, and nothing once stopped."""
+
+    def __init__(self, lexer, text):
+        self.lexer = lexer
+        self.text = text
+
+    def test(self, num=0, debug=False):
+        stats = LexerStats()
+        self.lexer.set_stats(stats)
+        tokens = self.lexer.lex(self.text, [])
+        self.lexer.set_stats(None)
+        self.lexer.lex(self.text, [])
+        if sum(stats.tokens.values()) != len(tokens) or stats.get_total_characters() != len(self.text):
+            raise Exception(f"Error: the statistics do not count all the tokens of {self.text}")
+        if self.lexer.engine == 'simple' and len(stats.attempts) == 0:
+            raise Exception(f"Error: the statistics do not count the attempts for {self.text}")
+        if debug:
+            print(stats.report(self.lexer.get_language()))
+        print(f"[SUCCESS] Test n°{num} Lang : {self.lexer.get_language()} stats of |{ln(self.text)}|")
+
+
+class TestAnalyze:
+    """Check the kinds of problems found by Language.analyze and that strict raises."""
+
+    def __init__(self, lang, kinds):
+        self.lang = lang
+        self.kinds = kinds
+
+    def test(self, num=0, debug=False):
+        analysis = self.lang.analyze()
+        kinds = {(self.lang.get_variants()[index][0], kind) for index, kind, message in analysis.problems}
+        if kinds != self.kinds:
+            raise Exception(f"Error: expected {self.kinds} and got {kinds} for {self.lang}")
+        try:
+            self.lang.analyze(strict=True)
+            raised = False
+        except Exception:
+            raised = True
+        if raised != (len(self.kinds) > 0):
+            raise Exception(f"Error: strict analyze does not raise for {self.lang}")
+        if debug:
+            print(analysis)
+        print(f"[SUCCESS] Test n°{num} Lang : {self.lang} analyze")
+
+
+class TestLimits:
+    """Check that a limit raises with the tokens found before, in several threads too, or falls back to the text language."""
+
+    def __init__(self, lexer, text, limits, limit, position):
+        self.lexer = lexer
+        self.text = text
+        self.limits = limits
+        self.limit = limit
+        self.position = position
+
+    def test(self, num=0, debug=False):
+        self.lexer.set_limits(**self.limits)
+        try:
+            self.lexer.lex(self.text)
+            raise Exception(f"Error: the limit {self.limit} is not raised for {self.text}")
+        except LexingLimitException as e:
+            if e.limit != self.limit or e.position != self.position:
+                raise Exception(f"Error: expected {self.limit} at {self.position} and got {e.limit} at {e.position}")
+            if e.tokens != self.lexer.lex_with_find(self.text[:self.position], self.lexer.discards):
+                raise Exception(f"Error: the partial tokens are wrong: {e.tokens}")
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6) # switch threads often, while they lex
+        try:
+            with ThreadPoolExecutor(4) as executor:
+                errors = list(executor.map(self.get_error, range(16)))
+        finally:
+            sys.setswitchinterval(interval)
+        if errors != [(self.limit, self.position)] * 16:
+            raise Exception(f"Error: the limit is not counted apart in each thread: {errors}")
+        self.lexer.set_limits(fallback=True, **self.limits)
+        tokens = self.lexer.lex(self.text)
+        self.lexer.set_limits()
+        if ''.join(tok.get_value() for tok in tokens) != self.text or tokens[-1].get_type() != 'normal':
+            raise Exception(f"Error: the fallback does not give the text: {tokens}")
+        print(f"[SUCCESS] Test n°{num} Lang : {self.lexer.get_language()} limit {self.limit}")
+
+    def get_error(self, index):
+        try:
+            self.lexer.lex(self.text * 50)
+        except LexingLimitException as e:
+            return e.limit, e.position
+
+
+class TestImport:
+    """Import weyland in a new interpreter and check it has no side effect, even after membership tests."""
+
+    CHECK = ("import logging, sys, weyland; "
+             "assert 'python' in weyland.RECOGNIZED_LANGUAGES and 'lua' in weyland.LANGUAGES; "
+             "assert [] not in weyland.LANGUAGES and 'nope' not in weyland.LANGUAGES; "
+             "print(logging.getLogger().level, len(logging.getLogger().handlers), "
+             "any(weyland.LANGUAGES.is_loaded(name) for name in weyland.LANGUAGES), "
+             "'concurrent.futures' in sys.modules)")
+
+    def test(self, num=0, debug=False):
+        result = subprocess.run([sys.executable, '-c', self.CHECK], capture_output=True, text=True, check=True)
+        if result.stdout.split() != ['30', '0', 'False', 'False']:
+            raise Exception(f"Error: import weyland has side effects (root level, handlers, "
+                            f"languages made, concurrent imported): {result.stdout.strip()}")
+        print(f"[SUCCESS] Test n°{num} import weyland without side effect")
+
+
+class TestStream:
+    """Write the tokens of a text in a token stream and read them back, with and without the lexemes."""
+
+    def __init__(self, lexer, text):
+        self.lexer = lexer
+        self.text = text
+
+    def test(self, num=0, debug=False):
+        tokens = self.lexer.lex(self.text)
+        stream = self.lexer.to_stream(tokens=tokens)
+        if stream != self.lexer.to_stream(text=io.StringIO(self.text)):
+            raise Exception("Error: the token streams of the tokens and of the text are different")
+        results = [list(self.lexer.read_stream(stream)),
+                   list(self.lexer.read_stream(io.BytesIO(self.lexer.to_stream(text=self.text, lexemes=False)),
+                                               self.text, size=3))]
+        for result in results:
+            if result != tokens:
+                raise Exception(f"Error: tokens read {result} instead of {tokens}")
+        binary = list(self.lexer.read_stream(self.lexer.to_stream(text=self.text.encode('utf8'))))
+        if [tok.value.decode('utf8') for tok in binary] != [tok.value for tok in tokens]:
+            raise Exception(f"Error: tokens read from bytes {binary}")
+        try:
+            list(self.lexer.read_stream(stream[:-3]))
+            raise Exception("Error: a truncated token stream should raise a LexingException")
+        except LexingException:
+            pass
+        print(f"[SUCCESS] Test n°{num} token stream of {len(tokens)} tokens in {len(stream)} bytes")
+
+
+class TestCache:
+    """Lex texts again with a cache of two results spilling in a directory, the results must not change."""
+
+    TEXTS = ['a = 1', 'local b = "s" -- c', 'while x do y() end', 'a = 1']
+
+    def test(self, num=0, debug=False):
+        lexer = Lexer(LANGUAGES['lua'], ['blank'])
+        expected = [(lexer.lex(text), lexer.to_html(text)) for text in TestCache.TEXTS]
+        with tempfile.TemporaryDirectory() as directory:
+            cache = LexerCache(entries=2, directory=directory)
+            lexer.set_cache(cache)
+            for _ in range(2):
+                for text, (tokens, html) in zip(TestCache.TEXTS, expected):
+                    if lexer.lex(text) != tokens or lexer.to_html(text) != html:
+                        raise Exception(f"Error: cached results of {text} are different")
+            lexer.set_cache(None)
+        if (cache.get_hits(), cache.get_misses(), cache.disk_hits) != (10, 6, 8):
+            raise Exception(f"Error: unexpected counters {cache}")
+        print(f"[SUCCESS] Test n°{num} cache {cache}")
+
+
+class TestDiskCache:
+    """Spill a cache of one result in a directory of two files at most, a result read from it is kept in memory again."""
+
+    TEXTS = [f'x{index} = {index}' for index in range(6)] + ['x4 = 4'] * 2
+
+    def test(self, num=0, debug=False):
+        lexer = Lexer(LANGUAGES['lua'], ['blank'])
+        expected = [lexer.lex(text) for text in TestDiskCache.TEXTS]
+        with tempfile.TemporaryDirectory() as directory:
+            cache = LexerCache(entries=1, directory=directory, disk_bytes=400)
+            lexer.set_cache(cache)
+            if [lexer.lex(text) for text in TestDiskCache.TEXTS] != expected:
+                raise Exception("Error: cached results are different")
+            lexer.set_cache(None)
+            sizes = [os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)]
+            reopened = LexerCache(directory=directory)
+        if (cache.get_hits(), cache.disk_hits, cache.get_misses(), cache.disk_evictions) != (2, 1, 6, 4):
+            raise Exception(f"Error: unexpected counters {cache}")
+        if len(sizes) != 2 or sum(sizes) != cache.disk_size or sum(sizes) != reopened.disk_size or sum(sizes) > 400:
+            raise Exception(f"Error: the files of the cache are not {cache.disk_size} bytes: {sizes}")
+        print(f"[SUCCESS] Test n°{num} disk cache {cache}")
+
+
+class TestPositions:
+    """Check the line and col of the tokens, the conversions of offsets and the tokens of a line range."""
+
+    TEXT = 'a = 1\n\n  c = "é" --[[ x\ny --]]\n'
+
+    def test(self, num=0, debug=False):
+        tokens, index = Lexer(LANGUAGES['lua'], ['blank', 'newline']).lex_positions(TestPositions.TEXT)
+        positions = [(tok.value, tok.line, tok.col) for tok in tokens]
+        expected = [('a', 1, 1), ('=', 1, 3), ('1', 1, 5), ('c', 3, 3), ('=', 3, 5), ('"é"', 3, 7),
+                    ('--[[ x\ny --]]\n', 3, 11)]
+        if positions != expected:
+            raise Exception(f"Error: positions {positions} instead of {expected}")
+        for offset in range(len(TestPositions.TEXT)):
+            if index.get_offset(*index.get_position(offset)) != offset:
+                raise Exception(f"Error: offset {offset} at {index.get_position(offset)}")
+        lines = [tok.value for tok in index.get_tokens(tokens, 4, 4)]
+        if lines != ['--[[ x\ny --]]\n']:
+            raise Exception(f"Error: tokens of line 4 {lines}")
+        if LineIndex(TestPositions.TEXT.encode('utf8')).get_position(16) != (3, 10):
+            raise Exception("Error: wrong position in bytes")
+        print(f"[SUCCESS] Test n°{num} positions of {len(tokens)} tokens on {index.get_line_count()} lines")
+
+
+class TestLines:
+    """Lex a text line by line, edit it, and compare each line with the tokens of the whole text.
+
+    Asking for a line after the last one raises.
+    """
+
+    def __init__(self, lexer, text, edits):
+        self.lexer = lexer
+        self.text = text
+        self.edits = edits
+
+    def check(self, lines):
+        text = lines.get_text()
+        index = LineIndex(text)
+        expected = [[] for _ in range(index.get_line_count())]
+        for tok in self.lexer.lex(text):
+            start, end = tok.start, tok.start + len(tok.value)
+            line = index.get_position(start)[0]
+            while start < end:
+                cut = min(end, index.get_line_end(line))
+                expected[line - 1].append((tok.typ, text[start:cut], start - index.get_line_start(line)))
+                start = cut
+                line += 1
+        result = [[(tok.typ, tok.value, tok.start) for tok in tokens]
+                  for tokens in lines.lex_lines(1, lines.get_line_count())]
+        if result != expected:
+            raise Exception(f"Error: lines lexed {result} instead of {expected}")
+
+    def test(self, num=0, debug=False):
+        lines = LineLexer(self.lexer, self.text)
+        self.check(lines)
+        for first, last, replacement in self.edits:
+            lines.lex_lines(lines.get_line_count(), lines.get_line_count())
+            lines.replace_lines(first, last, replacement)
+            self.check(lines)
+        after = lines.get_line_count() + 1
+        for ask in (lambda: lines.lex_lines(after, after + 2), lambda: lines.lex_line(after), lambda: lines.get_state(after),
+                    lambda: lines.lex_line(0)):
+            try:
+                ask()
+                raise Exception(f"Error: a line outside the {after - 1} lines of the text is lexed")
+            except LexingException:
+                pass
+        print(f"[SUCCESS] Test n°{num} {lines.get_line_count()} lines lexed line by line after {len(self.edits)} edits")
+
+
+class TestCandidates:
+    """Check that the variants fullmatching the tokens of random texts are candidates for their first character."""
+
+    def __init__(self, name, count=20):
+        self.name = name
+        self.count = count
+
+    def test(self, num=0, debug=False):
+        lang = LANGUAGES[self.name]
+        lexer = Lexer(lang)
+        variants = lang.get_variants()
+        for seed in range(self.count):
+            for tok in lexer.lex(make_text(self.name, seed)):
+                for index, (typ, elem) in enumerate(variants):
+                    if elem.fullmatch(tok.value) is not None and index not in lang.get_candidates(tok.value[0]):
+                        raise Exception(f"Error: variant {index} {elem.pattern} matches {tok.value} but is not a candidate")
+        print(f"[SUCCESS] Test n°{num} candidates of {self.name} on {self.count} random texts")
+
+
+class TestLiterals:
+    """Check the literal variants and match_indexes against fullmatching every variant on the tokens of random texts."""
+
+    def __init__(self, name, count=20):
+        self.name = name
+        self.count = count
+
+    def test(self, num=0, debug=False):
+        lang = LANGUAGES[self.name]
+        lexer = Lexer(lang)
+        variants = lang.get_variants()
+        for seed in range(self.count):
+            for tok in lexer.lex(make_text(self.name, seed)):
+                matches = [index for index, (typ, elem) in enumerate(variants) if elem.fullmatch(tok.value) is not None]
+                literals = [index for index in matches if index in lang.literal_indexes]
+                if sorted(lang.get_literal_matches(tok.value)) != literals:
+                    raise Exception(f"Error: literals {lang.get_literal_matches(tok.value)} for {tok.value} instead of {literals}")
+                if lexer.match_indexes(tok.value) != matches:
+                    raise Exception(f"Error: match_indexes {lexer.match_indexes(tok.value)} for {tok.value} instead of {matches}")
+        print(f"[SUCCESS] Test n°{num} literals of {self.name} on {self.count} random texts")
+
+
+class TestArray:
+    """Compare the TokenArray of lex_array with the tokens of lex on random texts."""
+
+    def __init__(self, name, count=10):
+        self.name = name
+        self.count = count
+
+    def test(self, num=0, debug=False):
+        lexer = Lexer(LANGUAGES[self.name], ['blank'])
+        for seed in range(self.count):
+            text = make_text(self.name, seed)
+            tokens = lexer.lex(text)
+            array = lexer.lex_array(text)
+            if len(array) != len(tokens) or array.to_tokens() != tokens or list(array) != tokens:
+                raise Exception(f"Error: the token array of {text} is {array.to_tokens()} instead of {tokens}")
+            for index, tok in enumerate(tokens):
+                if (array.get_type(index), array.get_value(index), array.get_start(index), array.get_end(index)) \
+                   != (tok.typ, tok.value, tok.start, tok.start + len(tok.value)):
+                    raise Exception(f"Error: the token {index} of the array of {text} is not {tok}")
+        print(f"[SUCCESS] Test n°{num} token arrays of {self.name} on {self.count} random texts")
+
+
+class TestParallel:
+    """Compare lex_parallel in 2 to 4 chunks with lex on random texts, in threads then once in processes."""
+
+    def __init__(self, name, count=10):
+        self.name = name
+        self.count = count
+
+    def test(self, num=0, debug=False):
+        lexer = Lexer(LANGUAGES[self.name], ['blank'])
+        with ThreadPoolExecutor(4) as executor:
+            for seed in range(self.count):
+                text = make_text(self.name, seed, 200)
+                for workers in range(2, 5):
+                    if lexer.lex_parallel(text, workers, executor=executor) != lexer.lex(text):
+                        raise Exception(f"Error: lex_parallel in {workers} chunks of {text} is not lex")
+        text = make_text(self.name, self.count, 2000)
+        if lexer.lex_parallel(text, 2) != lexer.lex(text):
+            raise Exception(f"Error: lex_parallel in processes of {text} is not lex")
+        print(f"[SUCCESS] Test n°{num} lex_parallel of {self.name} on {self.count + 1} random texts")
+
+
+class TestMany:
+    """Compare lex_many and to_html_many with lex and to_html, with languages of the same name.
+
+    They must not share a worker lexer or a cached result.
+    """
+
+    def test(self, num=0, debug=False):
+        documents = [make_text('lua', seed) for seed in range(12)]
+        lexer = Lexer(LANGUAGES['lua'], ['blank'])
+        expected = [lexer.lex(document) for document in documents]
+        for threads in (True, False):
+            if lex_many(documents, 'lua', ['blank'], threads=threads, workers=2, size=5) != expected:
+                raise Exception(f"Error: lex_many with threads={threads} is not lex")
+        html = to_html_many(documents, 'lua', ['blank'], 'dfa', workers=2, threads=True)
+        if html != [lexer.to_html(document, raws=['blank']) for document in documents]:
+            raise Exception("Error: to_html_many is not to_html")
+        results = [lex_many(['ab cd'], Language('custom', {typ: ['[a-z]+'], 'blank': [' ']}), threads=True)[0][0].typ
+                   for typ in ('word', 'name')]
+        if results != ['word', 'name']:
+            raise Exception(f"Error: two languages named custom share a lexer: {results}")
+        wrong = Language('c', {'x': ['a+'], 'b': [' ']}, wrong=['x'])
+        right = Language('c', {'x': ['a+'], 'b': [' ']})
+        cache = LexerCache()
+        for lang in (wrong, right, wrong):
+            lexer = Lexer(lang)
+            lexer.set_cache(cache)
+            for lex in (lexer.lex, lambda text: lex_many([text], lang, threads=True)[0]):
+                try:
+                    tokens = lex('aa')
+                except LexingException:
+                    tokens = None
+                if (tokens is None) != (lang is wrong):
+                    raise Exception(f"Error: the wrong types of {lang} are shared with another language c")
+        print(f"[SUCCESS] Test n°{num} lex_many and to_html_many of {len(documents)} documents")
+
+
+class TestHtml:
+    """Compare to_html, write_html and iter_html of texts, chunks and tokens with the html made from lex."""
+
+    def __init__(self, name, count=10):
+        self.name = name
+        self.count = count
+
+    def test(self, num=0, debug=False):
+        lexer = Lexer(LANGUAGES[self.name])
+        escapes = {'&': '&amp;', '>': '&gt;', '<': '&lt;', '"': '&quot;', "'": '&#x27;'}
+        for seed in range(self.count):
+            text = make_text(self.name, seed) + '<&>'
+            expected = ''.join(tok.value if tok.typ == 'blank' else
+                               f'<span class="{self.name}-{tok.typ}">' + ''.join(escapes.get(c, c) for c in tok.value) + '</span>'
+                               for tok in lexer.lex(text, []))
+            output = io.StringIO()
+            lexer.write_html(output, text=io.StringIO(text), raws=['blank'], size=3)
+            results = [lexer.to_html(text, raws=['blank']),
+                       lexer.to_html(tokens=lexer.lex(text, []), raws=['blank']),
+                       ''.join(lexer.iter_html([text[index:index + 7] for index in range(0, len(text), 7)], raws=['blank'])),
+                       output.getvalue()]
+            for result in results:
+                if result != expected:
+                    raise Exception(f"Error: html {result} instead of {expected}")
+        print(f"[SUCCESS] Test n°{num} html of {self.name} on {self.count} random texts")
+
+
+class TestCompiled:
+    """Save and load the compiled form of a language, in a cache directory or not, the tokens must not change."""
+
+    def __init__(self, name, count=5):
+        self.name = name
+        self.count = count
+
+    def test(self, num=0, debug=False):
+        make = LANGUAGES.factories[self.name]
+        texts = [make_text(self.name, seed) for seed in range(self.count)]
+        expected = [Lexer(LANGUAGES[self.name], [], engine).lex(text) for engine in Lexer.ENGINES for text in texts]
+        with tempfile.TemporaryDirectory() as directory:
+            language = make()
+            language.save_compiled(directory)
+            loaded = make()
+            if not loaded.load_compiled(directory) or loaded.get_compiled() != language.get_compiled():
+                raise Exception(f"Error: compiled form of {self.name} not loaded")
+            try:
+                set_cache_directory(directory)
+                cached = make()
+                set_cache_directory(os.path.join('/proc', 'nope'))
+                unwritable = make()
+            finally:
+                set_cache_directory(None)
+            if not os.path.exists(cached.get_cache_path(directory)):
+                raise Exception(f"Error: compiled form of {self.name} not saved by set_cache_directory")
+            for language in (loaded, cached, unwritable):
+                results = [Lexer(language, [], engine).lex(text) for engine in Lexer.ENGINES for text in texts]
+                if results != expected:
+                    raise Exception(f"Error: tokens of a compiled {self.name} are different")
+        print(f"[SUCCESS] Test n°{num} compiled {self.name} saved and loaded")
+
+
+class TestRelex:
+    """Apply random edits to random texts and compare relex with lex."""
+
+    def __init__(self, lexer, name, count=40):
+        self.lexer = lexer
+        self.name = name
+        self.count = count
+
+    def test(self, num=0, debug=False):
+        rand = random.Random(num)
+        for seed in range(self.count):
+            text = make_text(self.name, seed)
+            tokens = self.lexer.lex(text)
+            for _ in range(5):
+                offset = rand.randint(0, len(text))
+                deleted = rand.randint(0, min(4, len(text) - offset))
+                inserted = ''.join(rand.choice(PIECES[self.name]) for _ in range(rand.randint(0, 2)))
+                edited = text[:offset] + inserted + text[offset + deleted:]
+                try:
+                    expected = self.lexer.lex(edited)
+                except LexingException:
+                    continue
+                result = self.lexer.relex(edited, tokens, offset, deleted, inserted)
+                if result != expected:
+                    raise Exception(f"Error: relex of {edited} gives {result} instead of {expected}")
+                text, tokens = edited, result
+        print(f"[SUCCESS] Test n°{num} relex of {self.lexer.get_language()} with {self.lexer.engine} on random edits")
+
+
+class TestChunks:
+    """Lex random texts cut in chunks of 1 to 5 characters and compare with lex."""
+
+    def __init__(self, name, engine, count=10):
+        self.name = name
+        self.engine = engine
+        self.count = count
+
+    def test(self, num=0, debug=False):
+        lexer = Lexer(LANGUAGES[self.name], ['blank'], self.engine)
+        for seed in range(self.count):
+            text = make_text(self.name, seed) + ' --[[ x\n' * (self.name == 'lua')
+            for size in range(1, 6):
+                tokens = list(lexer.iter_tokens([text[index:index + size] for index in range(0, len(text), size)]))
+                if tokens != lexer.lex(text) or list(lexer.iter_tokens(io.StringIO(text), size=size)) != tokens:
+                    raise Exception(f"Error: the tokens of {text} in chunks of {size} are different: {tokens}")
+        print(f"[SUCCESS] Test n°{num} tokens of {self.name} with {self.engine} in chunks of 1 to 5 characters")
+
+
+class TestServer:
+    """Send requests to a server with threads or processes on a free port and check the answers."""
+
+    REQUESTS = [
+        ('/lex', {'lang': 'lua', 'text': 'a = 1', 'discards': ['blank'], 'id': 7}, 200,
+         {'id': 7, 'lang': 'lua', 'tokens': [['identifier', 'a', 0], ['operator', '=', 2], ['number', '1', 4]]}),
+        ('/to_html', {'lang': 'lua', 'text': 'a<1'}, 200,
+         {'id': None, 'lang': 'lua', 'result': '<span class="lua-identifier">a</span>'
+                                               '<span class="lua-operator">&lt;</span>'
+                                               '<span class="lua-number">1</span>'}),
+        ('/lex', {'lang': 'cobol', 'text': 'a'}, 400, None),
+        ('/lex', {'lang': 'lua', 'text': 'a = $'}, 400, None),
+        ('/lex', {'lang': 'lua', 'text': 'x' * 200}, 413, None),
+        ('/lex', {'lang': 'lua', 'text': 'a', 'discards': 'blank'}, 400, None),
+        ('/lex', {'lang': 'lua', 'text': 'a', 'discards': [['x']]}, 400, None),
+        ('/to_html', {'lang': 'lua', 'text': 'a', 'raws': 5}, 400, None),
+        ('/lex', {'lang': 'lua', 'text': 'a b', 'discards': ['blank', 'client']}, 200,
+         {'id': None, 'lang': 'lua', 'tokens': [['identifier', 'a', 0], ['identifier', 'b', 2]]}),
+    ]
+
+    def __init__(self, threads):
+        self.threads = threads
+
+    @staticmethod
+    async def request(port, path, params):
+        reader, writer = await asyncio.open_connection('localhost', port)
+        body = json.dumps(params).encode('utf8')
+        writer.write(f'POST {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode('latin-1') + body)
+        data = await reader.read()
+        writer.close()
+        head, _, body = data.partition(b'\r\n\r\n')
+        return int(head.split()[1]), json.loads(body)
+
+    async def run(self):
+        server = await Server(port=0, workers=2, threads=self.threads, max_size=100).start()
+        try:
+            return [await TestServer.request(server.port, path, params) for path, params, _, _ in TestServer.REQUESTS]
+        finally:
+            await server.close()
+
+    def test(self, num=0, debug=False):
+        answers = asyncio.run(self.run())
+        for (path, params, status, expected), (code, answer) in zip(TestServer.REQUESTS, answers):
+            if code != status or (expected is not None and answer != expected):
+                raise Exception(f"Error: {path} with {params} answered {code} {answer}")
+            if expected is None and answer.get('error') is not True:
+                raise Exception(f"Error: {path} with {params} should answer an error: {answer}")
+        if any('client' in discards for name, discards, engine in WORKER_LEXERS):
+            raise Exception("Error: a lexer was made for the discards of a client")
+        print(f"[SUCCESS] Test n°{num} server with {'threads' if self.threads else 'processes'} answered {len(answers)} requests")
+
+#-------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------
+
+# Pieces of texts assembled at random by the tests comparing a feature with lex
+PIECES = {
+    'ash': ['if ', 'then', 'elif', 'end', ' ', '\n', 'x', 'abc', 'a_1', ' 12 ', ' 3.5 ', '..', '+=', '-', '=', '"s\\n"', "'c'", '(', ')', ',', '-- c\n', 'true', 'nil'],
+    'game': ["Total ", "Baldur's", 'Half-life', ' ', '\n', ' 12 ', ':', 'x', '\t'],
+    'hamill': ['var ', 'const', 'x', ' : ', ' 12 ', 'true', '{', '}', '#', '.', '§§', ' ', '\n', 'css', 'ab_1'],
+    'lua': ['local ', 'x', 'ab', ' = ', ' 12 ', ' 3.5 ', '"str"', "'s'", '-- c\n', '..', '==', '~=', '<=', '>>', '(', ')', '{', '}', '[', ']', ',', 'function', 'end', '\n', ' ', 'a_1', 'not', 'nil', 'print', 'pairs'],
+    'python': ['def ', 'x', 'ab', ' = ', ' 12 ', ' 2.5 ', '"s"', "'t'", '# c\n', '**=', '//', '<<', '>=', '(', ')', '[', ']', ':', ',', 'None', 'True', '\n', '    ', 'lambda', 'in', '.'],
+    'text': ['Lorem ', 'ipsum', '\t', '\n', 'é', ' ', '.'],
+    'long': ['ab', 'c', 'd', 'e', 'abcd', 'cde'],
+}
+
+def make_text(name, seed, count=40):
+    rand = random.Random(seed)
+    return ''.join(rand.choice(PIECES[name]) for _ in range(count))
+
+
+lex_lua = Lexer(LANGUAGES['lua'], ['blank'])
+lex_ash = Lexer(LANGUAGES['ash'], ['blank'])
+lex_lua_regex = Lexer(LANGUAGES['lua'], ['blank'], 'regex')
+lex_lua_dfa = Lexer(LANGUAGES['lua'], ['blank'], 'dfa')
+lex_ash_dfa = Lexer(LANGUAGES['ash'], ['blank'], 'dfa')
+# The longest token needs more than one character of lookahead
+lang_arrow = Language('arrow', {'operator': ['-', '-->'], 'identifier': ['[a-z]+']})
+# IGNORECASE is not handled by the automaton
+lang_case = Language('case', {'keyword': ['(?i:select)'], 'identifier': ['[a-z]+'], 'blank': [' ']})
+# A token known only three characters after the end of the shorter ones
+lang_long = Language('long', {'long': ['abcde'], 'ab': ['ab'], 'c': ['c'], 'd': ['d'], 'e': ['e']})
+lang_slow = Language('slow', {'words': ['(\\w+\\s?)*'], 'optional': ['(\\w\\d?)+'], 'alternatives': ['(ab|\\w+)+'], 'blank': [' ']})
+
+TESTS = [
+    Test(lex_lua, '3+5', ['number', 'operator', 'number']),
+    Test(lex_lua, 'a = 5', ['identifier', 'operator', 'number']),
+    Test(lex_lua, 't = { ["k1"] = 5 }', ['identifier', 'operator', 'separator', 'separator', 'string', 'separator', 'operator', 'number', 'separator']),
+    Test(lex_lua, 't = { ["k1"] = 5, ["k2"] = "v", [4] = 6 } -- Définition\nprint(t["k1"]) -- Accès\nprint(t.k1) -- Accès avec sucre syntaxique',
+            ['identifier', 'operator', 'separator', 'separator', 'string', 'separator', 'operator', 'number', 'separator',
+             'separator', 'string', 'separator', 'operator', 'string', 'separator', 'separator', 'number', 'separator', 'operator', 'number',
+             'separator', 'comment', 'special', 'separator', 'identifier', 'separator', 'string', 'separator', 'separator', 'comment',
+             'special', 'separator', 'identifier', 'operator', 'identifier', 'separator', 'comment']),
+    Test(lex_lua, '--[[Ceci est un\nz--]]', ['comment']),
+    Test(lex_lua, '--[[Ceci est un\ncommentaire multiligne--]]', ['comment']),
+    Test(lex_ash, '2..3', ['number', 'operator', 'number']),
+    Test(lex_ash, 'a = 5', ['identifier', 'operator', 'number']),
+    Test(lex_lua_regex, 't = { ["k1"] = 5, ["k2"] = "v" } -- Définition\nprint(t.k1)',
+            ['identifier', 'operator', 'separator', 'separator', 'string', 'separator', 'operator', 'number', 'separator',
+             'separator', 'string', 'separator', 'operator', 'string', 'separator', 'comment',
+             'special', 'separator', 'identifier', 'operator', 'identifier', 'separator']),
+    Test(lex_lua_regex, '--[[Ceci est un\ncommentaire multiligne--]]', ['comment']),
+    Test(lex_lua_dfa, 't = { ["k1"] = 5, ["k2"] = "v" } -- Définition\nprint(t.k1)',
+            ['identifier', 'operator', 'separator', 'separator', 'string', 'separator', 'operator', 'number', 'separator',
+             'separator', 'string', 'separator', 'operator', 'string', 'separator', 'comment',
+             'special', 'separator', 'identifier', 'operator', 'identifier', 'separator']),
+    Test(lex_lua_dfa, '--[[Ceci est un\ncommentaire multiligne--]]', ['comment']),
+    Test(lex_ash_dfa, '2..3', ['number', 'operator', 'number']),
+    Test(Lexer(lang_arrow), 'a-->b--c', ['identifier', 'operator', 'identifier', 'operator', 'operator', 'identifier']),
+    Test(Lexer(lang_arrow, [], 'regex'), 'a-->b--c', ['identifier', 'operator', 'identifier', 'operator', 'operator', 'identifier']),
+    Test(Lexer(lang_arrow, [], 'dfa'), 'a-->b--c', ['identifier', 'operator', 'identifier', 'operator', 'operator', 'identifier']),
+    Test(Lexer(lang_case, ['blank']), 'SELECT ab', ['keyword', 'identifier']),
+    TestViews(lex_lua, 'a = "s" .. b -- c\nprint(a)'),
+    TestViews(lex_lua_dfa, 'a = "s" .. b -- c\nprint(a)'),
+    TestBytes(lex_lua, 't = { ["k1"] = "é" } -- Définition\nprint(t.k1)'),
+    TestBytes(lex_lua_dfa, '--[[Ceci est un\ncommentaire multiligne--]]'),
+    *[TestBytes(Lexer(LANGUAGES[name], [], engine), text) for name, text in
+      (('python', 'café = 1 # déjà'), ('game', 'Pokémon'), ('hamill', '§ ça'), ('lua', 'a = "€" -- été'))
+      for engine in Lexer.ENGINES],
+    TestStats(Lexer(LANGUAGES['lua']), 'a = "s" .. b -- c\nprint(a)'),
+    TestStats(Lexer(LANGUAGES['lua'], [], 'dfa'), 'a = "s" .. b -- c\nprint(a)'),
+    TestAnalyze(LANGUAGES['lua'], {('comment', 'unbounded'), ('intermediate_comment', 'unbounded'),
+                                   ('wrong_int', 'polynomial')}),
+    TestAnalyze(LANGUAGES['text'], set()),
+    TestAnalyze(lang_slow, {('words', 'exponential'), ('optional', 'exponential'),
+                           ('alternatives', 'exponential')}),
+    TestAnalyze(lang_case, {('keyword', 'automaton')}),
+    TestLimits(Lexer(LANGUAGES['lua']), 'a = 1 --[[ ' + 'x' * 100, {'size': 50}, 'size', 0),
+    TestLimits(Lexer(LANGUAGES['lua']), 'a = 1 --[[ ' + 'x' * 100, {'token': 50}, 'token', 6),
+    TestLimits(Lexer(LANGUAGES['lua'], [], 'dfa'), 'a = 1 --[[ ' + 'x' * 100, {'evaluations': 20}, 'evaluations', 6),
+    TestLimits(Lexer(LANGUAGES['lua'], [], 'regex'), 'a = 1 --[[ ' + 'x' * 100, {'evaluations': 3}, 'evaluations', 3),
+    # A single long token is stopped by the time limit while it is found
+    *[TestLimits(Lexer(LANGUAGES['lua'], [], engine), 'x = "' + 'a' * 20000 + '\\z', {'seconds': 0.1}, 'seconds', 4)
+      for engine in ('simple', 'regex')],
+    TestImport(),
+    TestServer(True),
+    TestServer(False),
+    TestStream(Lexer(LANGUAGES['lua'], [], 'dfa'), 'local s = "été" --[[ multi\nline ]] x = 1.5e3'),
+    TestStream(Lexer(LANGUAGES['hamill']), '§§ note\nvar x : 12\n'),
+    TestCache(),
+    TestDiskCache(),
+    TestPositions(),
+    TestLines(Lexer(LANGUAGES['lua'], ['blank']), 'a = 1\n--[[ x\ny --]]\nb = "s"\n',
+              [(2, 2, ['-- x\n']), (3, 3, ['c = 2 --[[ z\n', '\n']), (1, 1, [])]),
+    TestLines(Lexer(LANGUAGES['python'], [], 'dfa'), 'def f(a):\n    return a\n\n\nx = f(1)',
+              [(3, 4, []), (1, 1, ['class A:\n', '    pass\n'])]),
+    *[TestCandidates(name) for name in LANGUAGES],
+    *[TestLiterals(name) for name in LANGUAGES],
+    *[TestArray(name) for name in LANGUAGES],
+    *[TestParallel(name) for name in ('lua', 'python', 'hamill')],
+    TestMany(),
+    *[TestCompiled(name) for name in ('lua', 'hamill')],
+    *[TestHtml(name) for name in ('lua', 'python', 'text')],
+    *[TestChunks(name, engine) for name in ('lua', 'python') for engine in Lexer.ENGINES],
+    TestChunks('hamill', 'simple'),
+    *[TestRelex(Lexer(LANGUAGES[name], ['blank'], engine), name) for name in LANGUAGES for engine in Lexer.ENGINES],
+    TestRelex(Lexer(lang_long), 'long'),
+    TestRelex(Lexer(lang_long, [], 'dfa'), 'long'),
+]
+
+#TESTS = [Test(lex, '3+5', ['number', 'operator', 'number']),]
+
+def tests(debug=False):
+    ok = 0
+    for index, t in enumerate(TESTS):
+        try:
+            t.test(index + 1, debug)
+            ok += 1
+        except Exception as e:
+            print(e)
+    print('-----------------------------')
+    print(f'SUCCESS: {ok:5d}')
+    print(f'FAILED:  {(len(TESTS)-ok):5d}')
+
+if __name__ == '__main__':
+    print(Token('number', 5, 0) == Token('number', 5, 0)) # True
+    print(Token('number', 5, 0) != Token('number', 5, 1)) # True
+    print(Token('number', 5, 0) == Token('number', 5, 1)) # False
+    print(repr(Token('number', 5, 0)))
+    tests(True)
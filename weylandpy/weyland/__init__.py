@@ -30,11 +30,7 @@
 __version__ = "0.2.7"
 
 # Imports
-import logging
 #from weyland.regex import *
 from weyland.lexer import *
-from weyland.languages import RECOGNIZED_LANGUAGES, LANGUAGES, PATTERNS, Language
-
-logging.basicConfig(format='%(levelname)s %(asctime)s %(message)s')
-logging.getLogger().setLevel(logging.DEBUG)
+from weyland.languages import RECOGNIZED_LANGUAGES, LANGUAGES, PATTERNS, Language, LanguageRegistry, set_cache_directory
 
@@ -0,0 +1,637 @@
+# -----------------------------------------------------------
+# MIT Licence (Expat License Wording)
+# -----------------------------------------------------------
+# Copyright © 2020, Damien Gouteux
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# For more information about my projects see:
+# https://xitog.github.io/dgx (in French)
+
+"""Automaton: compile the regex of a language into one minimized DFA"""
+
+#-------------------------------------------------------------------------------
+#
+# The regex are parsed by the parser of the re module. Each element of the
+# parsed regex becomes a node of a NFA:
+#
+#   char    : consumes one character of a char set
+#   split   : epsilon transitions to several nodes
+#   begin   : ^ or \A
+#   end     : $ or \Z
+#   guard   : a lookahead (?=...) or (?!...), run beside the main thread
+#   match   : the variant number n is matched
+#   gaccept : the body of a lookahead is matched
+#
+# The characters are partitioned into classes: two characters of the same
+# class belong to the same char sets. The DFA is built on these classes by
+# the subset construction then minimized. Each accepting state keeps the
+# index of the first defined variant matching the word.
+#
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+import bisect
+import re
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+#-------------------------------------------------------------------------------
+# Globals and constants
+#-------------------------------------------------------------------------------
+
+# Index of the category in a combination and if it is negated
+CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT     : (0, False),
+    sre_constants.CATEGORY_NOT_DIGIT : (0, True),
+    sre_constants.CATEGORY_WORD      : (1, False),
+    sre_constants.CATEGORY_NOT_WORD  : (1, True),
+    sre_constants.CATEGORY_SPACE     : (2, False),
+    sre_constants.CATEGORY_NOT_SPACE : (2, True),
+}
+CATEGORY_TESTS = [re.compile('\\d').fullmatch, re.compile('\\w').fullmatch, re.compile('\\s').fullmatch]
+# Combinations of (digit, word, space) found outside ASCII, all the ASCII characters are tested
+UNICODE_COMBINATIONS = [(True, True, False), (False, True, False), (False, False, True), (False, False, False)]
+
+# A char set is (negated, chars, ranges, categories)
+NEWLINE = (False, frozenset('\n'), (), ())
+EVERYTHING = (True, frozenset(), (), ())
+
+MAX_REPEAT = 100
+
+# Characters used to compare what the parts of a regex can match
+SAMPLE = frozenset([chr(code) for code in range(128)] + ['\xa0', 'é', 'ж', '٣', '中'])
+REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+DEAD = 0
+START = 1 # before minimization
+
+#-------------------------------------------------------------------------------
+# Classes
+#-------------------------------------------------------------------------------
+
+class AutomatonException(Exception):
+    pass
+
+
+class NFA:
+
+    def __init__(self):
+        self.kinds = []
+        self.args = []
+        self.outs = []
+        self.charsets = []
+        self.charset_index = {}
+
+    def add(self, kind, arg=None, outs=None):
+        self.kinds.append(kind)
+        self.args.append(arg)
+        self.outs.append([] if outs is None else outs)
+        return len(self.kinds) - 1
+
+    def add_charset(self, charset):
+        if charset not in self.charset_index:
+            self.charset_index[charset] = len(self.charsets)
+            self.charsets.append(charset)
+        return self.charset_index[charset]
+
+    def compile(self, pattern, flags, index):
+        """Add the pattern for the variant index and return its starting node."""
+        try:
+            parsed = sre_parse.parse(pattern, flags)
+        except re.error as e:
+            raise AutomatonException(f'Invalid regex {pattern}: {e}')
+        flags = parsed.state.flags
+        return self.sequence(parsed, self.add('match', index), flags, False)
+
+    def sequence(self, items, next, flags, in_guard):
+        for op, av in reversed(list(items)):
+            next = self.element(op, av, next, flags, in_guard)
+        return next
+
+    def element(self, op, av, next, flags, in_guard):
+        if flags & (re.I | re.L | re.A):
+            raise AutomatonException('Flags IGNORECASE, LOCALE and ASCII are not handled')
+        if op == sre_constants.LITERAL:
+            return self.add('char', self.add_charset((False, frozenset(chr(av)), (), ())), [next])
+        elif op == sre_constants.NOT_LITERAL:
+            return self.add('char', self.add_charset((True, frozenset(chr(av)), (), ())), [next])
+        elif op == sre_constants.ANY:
+            charset = EVERYTHING if flags & re.S else (True, frozenset('\n'), (), ())
+            return self.add('char', self.add_charset(charset), [next])
+        elif op == sre_constants.IN:
+            return self.add('char', self.add_charset(self.charset(av)), [next])
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            mini, maxi, item = av
+            if mini > MAX_REPEAT or (maxi != sre_constants.MAXREPEAT and maxi > MAX_REPEAT):
+                raise AutomatonException(f'Repetition over {MAX_REPEAT} times is not handled')
+            if maxi == sre_constants.MAXREPEAT:
+                loop = self.add('split')
+                self.outs[loop] = [self.sequence(item, loop, flags, in_guard), next]
+                next = loop
+            else:
+                for _ in range(maxi - mini):
+                    next = self.add('split', None, [self.sequence(item, next, flags, in_guard), next])
+            for _ in range(mini):
+                next = self.sequence(item, next, flags, in_guard)
+            return next
+        elif op == sre_constants.SUBPATTERN:
+            group, add_flags, del_flags, item = av
+            return self.sequence(item, next, (flags | add_flags) & ~del_flags, in_guard)
+        elif op == sre_constants.BRANCH:
+            return self.add('split', None, [self.sequence(item, next, flags, in_guard) for item in av[1]])
+        elif op == sre_constants.AT and not in_guard:
+            if av == sre_constants.AT_BEGINNING:
+                return self.add('begin', bool(flags & re.M), [next])
+            elif av == sre_constants.AT_BEGINNING_STRING:
+                return self.add('begin', False, [next])
+            elif av == sre_constants.AT_END:
+                return self.add('end', 'line' if flags & re.M else 'newline', [next])
+            elif av == sre_constants.AT_END_STRING:
+                return self.add('end', 'string', [next])
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT) and not in_guard:
+            direction, item = av
+            if direction == 1:
+                start = self.sequence(item, self.add('gaccept'), flags, True)
+                return self.add('guard', (op == sre_constants.ASSERT, start), [next])
+        raise AutomatonException(f'Regex element {op} {av} is not handled')
+
+    def closure(self, threads, previous):
+        """Follow the epsilon transitions. A thread is (node, guards).
+
+        previous is 'start' at the start of the word, 'newline' after a new line,
+        None otherwise.
+        """
+        result = set()
+        todo = list(threads)
+        seen = set(todo)
+        while len(todo) > 0:
+            node, guards = todo.pop()
+            kind = self.kinds[node]
+            nexts = []
+            if kind in ('char', 'match'):
+                result.add((node, guards))
+            elif kind == 'split':
+                nexts = [(out, guards) for out in self.outs[node]]
+            elif kind == 'begin':
+                if previous == 'start' or (self.args[node] and previous == 'newline'):
+                    nexts = [(self.outs[node][0], guards)]
+            elif kind == 'end':
+                nexts = [(self.outs[node][0], guards | {('end', self.args[node])})]
+            elif kind == 'guard':
+                positive, start = self.args[node]
+                inner = self.guard_closure({start})
+                accepted = any(self.kinds[n] == 'gaccept' for n in inner)
+                if positive and accepted:
+                    nexts = [(self.outs[node][0], guards)]
+                elif positive and len(inner) > 0:
+                    nexts = [(self.outs[node][0], guards | {('pos', inner)})]
+                elif not positive and not accepted:
+                    new_guards = guards if len(inner) == 0 else guards | {('neg', inner)}
+                    nexts = [(self.outs[node][0], new_guards)]
+            for thread in nexts:
+                if thread not in seen:
+                    seen.add(thread)
+                    todo.append(thread)
+        return frozenset(result)
+
+    def guard_closure(self, nodes):
+        result = set()
+        todo = list(nodes)
+        while len(todo) > 0:
+            node = todo.pop()
+            if node in result:
+                continue
+            result.add(node)
+            if self.kinds[node] == 'split':
+                todo.extend(self.outs[node])
+        return frozenset(n for n in result if self.kinds[n] in ('char', 'gaccept'))
+
+    def charset(self, items):
+        negated = False
+        chars = set()
+        ranges = []
+        categories = set()
+        for op, av in items:
+            if op == sre_constants.NEGATE:
+                negated = True
+            elif op == sre_constants.LITERAL:
+                chars.add(chr(av))
+            elif op == sre_constants.RANGE:
+                ranges.append(av)
+            elif op == sre_constants.CATEGORY and av in CATEGORIES:
+                categories.add(CATEGORIES[av])
+            else:
+                raise AutomatonException(f'Char set element {op} {av} is not handled')
+        return (negated, frozenset(chars), tuple(sorted(ranges)), tuple(sorted(categories)))
+
+
+def get_literal(pattern, flags):
+    """Return the string matched by the pattern if it matches only this string, None otherwise."""
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error:
+        return None
+    if parsed.state.flags & (re.I | re.L):
+        return None
+    items = list(parsed)
+    if len(items) > 0 and items[0] in ((sre_constants.AT, sre_constants.AT_BEGINNING),
+                                       (sre_constants.AT, sre_constants.AT_BEGINNING_STRING)):
+        items = items[1:]
+    if len(items) > 0 and items[-1] in ((sre_constants.AT, sre_constants.AT_END),
+                                        (sre_constants.AT, sre_constants.AT_END_STRING)):
+        items = items[:-1]
+    if len(items) == 0 or any(op != sre_constants.LITERAL for op, av in items):
+        return None
+    return ''.join(chr(av) for op, av in items)
+
+
+def get_first_charsets(pattern, flags):
+    """Return the char sets of the first character of the words matching the pattern.
+
+    Return None if the pattern cannot be handled.
+    """
+    nfa = NFA()
+    try:
+        start = nfa.compile(pattern, flags, 0)
+    except AutomatonException:
+        return None
+    return [nfa.charsets[nfa.args[node]] for node, guards in nfa.closure({(start, frozenset())}, 'start')
+            if nfa.kinds[node] == 'char']
+
+
+def get_backtracking(pattern, flags):
+    """Return the backtracking problems of the pattern as a list of (kind, message).
+
+    exponential : a repetition of a part matching a word in several ways
+    polynomial  : consecutive repetitions which can match the same characters
+    The characters are compared on a sample of ASCII and some other characters.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error as e:
+        return [('invalid', f'Invalid regex {pattern}: {e}')]
+    problems = []
+    check_sequence(list(parsed), parsed.state.flags, problems)
+    return list(dict.fromkeys(problems))
+
+
+def check_sequence(items, flags, problems):
+    for position, (op, av) in enumerate(items):
+        if op in REPEATS:
+            mini, maxi, item = av
+            if maxi == sre_constants.MAXREPEAT:
+                check_repeat(list(item), flags, problems)
+                chars = get_first(item, flags)[0]
+                for next_op, next_av in items[position + 1:]:
+                    if next_op in REPEATS and next_av[1] == sre_constants.MAXREPEAT \
+                       and len(chars & get_first(next_av[2], flags)[0]) > 0:
+                        problems.append(('polynomial', 'Consecutive repetitions can match the same characters'))
+                    if not get_first([(next_op, next_av)], flags)[1]:
+                        break
+            check_sequence(list(item), flags, problems)
+        elif op == sre_constants.SUBPATTERN:
+            check_sequence(list(av[3]), (flags | av[1]) & ~av[2], problems)
+        elif op == sre_constants.BRANCH:
+            for item in av[1]:
+                check_sequence(list(item), flags, problems)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            check_sequence(list(av[1]), flags, problems)
+
+
+def check_repeat(items, flags, problems):
+    """Check the body of an unbounded repetition: it must match a word in only one way."""
+    while len(items) == 1 and items[0][0] == sre_constants.SUBPATTERN:
+        items = list(items[0][1][3])
+    chars, empty = get_first(items, flags)
+    if empty:
+        problems.append(('exponential', 'A repetition of a part which can match the empty word'))
+    elif len(items) == 1 and items[0][0] == sre_constants.BRANCH:
+        seen = set()
+        for item in items[0][1][1]:
+            first = get_first(item, flags)[0]
+            if len(seen & first) > 0:
+                problems.append(('exponential', 'A repetition of alternatives which can start with the same characters'))
+                break
+            seen |= first
+    else:
+        # A nested repetition or an optional part at the end of the body can take the characters of the next turn
+        for op, av in reversed(items):
+            first, empty = get_first([(op, av)], flags)
+            if (empty or (op in REPEATS and av[1] == sre_constants.MAXREPEAT)) and len(chars & first) > 0:
+                problems.append(('exponential', 'The end of the repeated part can match the start of the next turn'))
+                break
+            if not empty:
+                break
+
+
+def get_first(items, flags):
+    """Return the sample characters which can start a word matched by items and if items can match the empty word."""
+    chars = set()
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            first, empty = {chr(av)}, False
+        elif op == sre_constants.NOT_LITERAL:
+            first, empty = SAMPLE - {chr(av)}, False
+        elif op == sre_constants.ANY:
+            first, empty = SAMPLE if flags & re.S else SAMPLE - {'\n'}, False
+        elif op == sre_constants.IN:
+            try:
+                charset = NFA().charset(av)
+                first = {c for c in SAMPLE | charset[1] if charset_contains(charset, c)}
+            except AutomatonException:
+                first = set(SAMPLE)
+            empty = False
+        elif op in REPEATS:
+            first, empty = get_first(av[2], flags)
+            empty = empty or av[0] == 0
+        elif op == sre_constants.SUBPATTERN:
+            first, empty = get_first(av[3], (flags | av[1]) & ~av[2])
+        elif op == sre_constants.BRANCH:
+            first, empty = set(), False
+            for item in av[1]:
+                item_first, item_empty = get_first(item, flags)
+                first |= item_first
+                empty = empty or item_empty
+        elif op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            first, empty = set(), True
+        else:
+            first, empty = set(SAMPLE), True
+        chars |= first
+        if not empty:
+            return chars, False
+    return chars, True
+
+
+def charset_contains(charset, c):
+    negated, chars, ranges, categories = charset
+    if len(categories) > 0:
+        combination = Automaton.combination(c)
+    res = c in chars or any(lo <= ord(c) <= hi for lo, hi in ranges) \
+          or any(combination[index] != neg for index, neg in categories)
+    return res != negated
+
+
+class Automaton:
+    """A minimized DFA for all the variants of a language.
+
+    table[state][class] gives the next state, accepts[state] the index of the
+    first defined variant matching the word or None. The lexing begins in the
+    state start, the state 0 is dead: no word going through it can match.
+    """
+
+    def __init__(self, variants):
+        self.variants = variants
+        nfa = NFA()
+        starts = [nfa.compile(elem.pattern, elem.flags, index) for index, (typ, elem) in enumerate(variants)]
+        nfa.add_charset(NEWLINE)
+        self.make_classes(nfa)
+        self.make_table(nfa, starts)
+
+    #---------------------------------------------------------------------------
+    # Character classes
+    #---------------------------------------------------------------------------
+
+    def make_classes(self, nfa):
+        bounds = {0, 128}
+        for negated, chars, ranges, categories in nfa.charsets:
+            for c in chars:
+                bounds.add(ord(c))
+                bounds.add(ord(c) + 1)
+            for lo, hi in ranges:
+                bounds.add(lo)
+                bounds.add(hi + 1)
+        self.bounds = sorted(bounds)
+        # Candidate classes are (segment, combination), merged if they belong to the same char sets
+        signatures = {}
+        self.segment_classes = {}
+        for segment, code in enumerate(self.bounds):
+            if code < 128:
+                combinations = set(self.combination(chr(c)) for c in range(code, self.bounds[segment + 1]))
+            else:
+                combinations = UNICODE_COMBINATIONS
+            for combination in combinations:
+                signature = tuple(self.inside(charset, code, combination) for charset in nfa.charsets)
+                if signature not in signatures:
+                    signatures[signature] = len(signatures)
+                self.segment_classes[(segment, combination)] = signatures[signature]
+        self.nb_classes = len(signatures)
+        self.members = [frozenset(cls for signature, cls in signatures.items() if signature[index])
+                        for index in range(len(nfa.charsets))]
+        self.newline = self.segment_classes[(bisect.bisect_right(self.bounds, 10) - 1, self.combination('\n'))]
+        self.classes = {}
+
+    @staticmethod
+    def inside(charset, code, combination):
+        negated, chars, ranges, categories = charset
+        res = chr(code) in chars or any(lo <= code <= hi for lo, hi in ranges) \
+              or any(combination[index] != neg for index, neg in categories)
+        return res != negated
+
+    @staticmethod
+    def combination(c):
+        return tuple(test(c) is not None for test in CATEGORY_TESTS)
+
+    def classify(self, c):
+        if c not in self.classes:
+            segment = bisect.bisect_right(self.bounds, ord(c)) - 1
+            key = (segment, self.combination(c))
+            if key not in self.segment_classes:
+                raise AutomatonException(f'No class for the character {c!r}')
+            self.classes[c] = self.segment_classes[key]
+        return self.classes[c]
+
+    #---------------------------------------------------------------------------
+    # Subset construction and minimization
+    #---------------------------------------------------------------------------
+
+    def step_guard(self, nfa, guard, cls):
+        """Return the guard after consuming a char of class cls, None if satisfied, False if failed."""
+        kind, data = guard
+        if kind == 'end':
+            if data == 'line':
+                return None if cls == self.newline else False
+            elif data == 'newline' and cls == self.newline:
+                return ('end', 'string')
+            return False
+        inner = nfa.guard_closure({nfa.outs[n][0] for n in data
+                                   if nfa.kinds[n] == 'char' and cls in self.members[nfa.args[n]]})
+        accepted = any(nfa.kinds[n] == 'gaccept' for n in inner)
+        if kind == 'pos':
+            if accepted:
+                return None
+            return (kind, inner) if len(inner) > 0 else False
+        if accepted:
+            return False
+        return (kind, inner) if len(inner) > 0 else None
+
+    def step(self, nfa, moves, cls):
+        """Return the threads after consuming a char of class cls, before the closure.
+
+        moves are the (next node, guards, members) of the char nodes of a state.
+        """
+        threads = set()
+        for out, guards, members in moves:
+            if cls not in members:
+                continue
+            new_guards = set()
+            for guard in guards:
+                guard = self.step_guard(nfa, guard, cls)
+                if guard is False:
+                    break
+                elif guard is not None:
+                    new_guards.add(guard)
+            else:
+                threads.add((out, frozenset(new_guards)))
+        return frozenset(threads)
+
+    def accept(self, nfa, state):
+        labels = [nfa.args[node] for node, guards in state
+                  if nfa.kinds[node] == 'match' and all(kind != 'pos' for kind, data in guards)]
+        return min(labels) if len(labels) > 0 else None
+
+    def make_table(self, nfa, starts):
+        dead = frozenset()
+        start = nfa.closure({(node, frozenset()) for node in starts}, 'start')
+        states = [dead, start]
+        index = {dead: DEAD, start: START}
+        closures = {}
+        table = []
+        todo = 0
+        while todo < len(states):
+            moves = [(nfa.outs[node][0], guards, self.members[nfa.args[node]])
+                     for node, guards in states[todo] if nfa.kinds[node] == 'char']
+            row = []
+            for cls in range(self.nb_classes):
+                # Many classes lead to the same threads, the closure is computed once
+                key = (self.step(nfa, moves, cls), cls == self.newline)
+                if key not in closures:
+                    closures[key] = nfa.closure(key[0], 'newline' if key[1] else None)
+                target = closures[key]
+                if target not in index:
+                    index[target] = len(states)
+                    states.append(target)
+                row.append(index[target])
+            table.append(row)
+            todo += 1
+        accepts = [self.accept(nfa, state) for state in states]
+        self.minimize(table, accepts)
+
+    def minimize(self, table, accepts):
+        # Moore: split the blocks of states until all the states of a block go to the same blocks
+        blocks = list(accepts)
+        while True:
+            keys = {}
+            new_blocks = []
+            for state, row in enumerate(table):
+                key = (blocks[state], tuple(blocks[target] for target in row))
+                new_blocks.append(keys.setdefault(key, len(keys)))
+            stable = len(keys) == len(set(blocks))
+            blocks = new_blocks
+            if stable:
+                break
+        # The states never leading to an accepting state are merged with the dead state
+        numbers = {blocks[DEAD]: DEAD}
+        numbers.setdefault(blocks[START], len(numbers))
+        for block in blocks:
+            numbers.setdefault(block, len(numbers))
+        self.start = numbers[blocks[START]]
+        self.table = [None] * len(numbers)
+        self.accepts = [None] * len(numbers)
+        for state, row in enumerate(table):
+            number = numbers[blocks[state]]
+            self.table[number] = [numbers[blocks[target]] for target in row]
+            self.accepts[number] = accepts[state]
+
+    def get_tables(self):
+        """Return what is needed to lex with the automaton, made of built-in types only."""
+        return {
+            'table': self.table,
+            'accepts': self.accepts,
+            'start': self.start,
+            'bounds': self.bounds,
+            'segment_classes': self.segment_classes,
+            'nb_classes': self.nb_classes,
+            'newline': self.newline,
+            'classes': self.classes,
+        }
+
+    @classmethod
+    def from_tables(cls, variants, tables):
+        automaton = cls.__new__(cls)
+        automaton.variants = variants
+        for name, value in tables.items():
+            setattr(automaton, name, value)
+        return automaton
+
+    def get_unbounded_states(self):
+        """Return the states which cannot lead to the dead state: a word reaching them can always grow."""
+        mortal = {DEAD}
+        changed = True
+        while changed:
+            changed = False
+            for state, row in enumerate(self.table):
+                if state not in mortal and any(target in mortal for target in row):
+                    mortal.add(state)
+                    changed = True
+        return set(range(len(self.table))) - mortal
+
+    def get_lookahead(self):
+        """Return the most characters read from the end of a token to know it, None if unbounded.
+
+        After the last accepting state of a token, the word goes through
+        states which do not accept until the dead state.
+        """
+        waiting = set(state for state in range(1, len(self.table)) if self.accepts[state] is None)
+        starts = set(target for state in range(1, len(self.table)) if self.accepts[state] is not None
+                     for target in self.table[state] if target in waiting)
+        # The longest path in the waiting states, from their successors first
+        lengths = {}
+        for root in starts:
+            stack = [(root, iter(set(self.table[root]) & waiting))]
+            path = {root}
+            while len(stack) > 0:
+                state, targets = stack[-1]
+                target = next(targets, None)
+                if target is None:
+                    stack.pop()
+                    path.discard(state)
+                    lengths[state] = 1 + max((lengths[t] for t in self.table[state] if t in waiting), default=0)
+                elif target in path:
+                    return None
+                elif target not in lengths:
+                    stack.append((target, iter(set(self.table[target]) & waiting)))
+                    path.add(target)
+        return 1 + max((lengths[state] for state in starts), default=0)
+
+    def get_number_of_states(self):
+        return len(self.table)
+
+    def get_number_of_classes(self):
+        return self.nb_classes
+
+    def __str__(self):
+        return f"Automaton with {self.get_number_of_states()} states and {self.get_number_of_classes()} classes"
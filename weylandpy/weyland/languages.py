@@ -30,13 +30,29 @@
 # Import
 #-------------------------------------------------------------------------------
 
+import marshal
+import os
 import re
+import sys
+from collections.abc import MutableMapping
+from weyland.automaton import Automaton, AutomatonException, get_backtracking, get_first_charsets, charset_contains, get_literal
+
+#-------------------------------------------------------------------------------
+# Functions
+#-------------------------------------------------------------------------------
+
+def set_cache_directory(directory):
+    """Set the directory where the compiled languages are saved and loaded, None for no cache."""
+    global CACHE_DIRECTORY
+    CACHE_DIRECTORY = directory
 
 #-------------------------------------------------------------------------------
 # Class
 #-------------------------------------------------------------------------------
 
 class Language:
+
+    SCOPED_FLAGS = [('i', re.I), ('m', re.M), ('s', re.S), ('x', re.X)]
     
     def __init__(self, name, definitions, wrong=None, specials=None):
         wrong = [] if wrong is None else wrong
@@ -62,6 +78,167 @@ class Language:
                         variants[index] = re.compile(pattern)
         self.specials = specials
         self.wrong = wrong
+        self.variants = [(typ, elem) for typ, elems in definitions.items() for elem in elems]
+        self.types = list(definitions.keys())
+        self.type_ids = {typ: index for index, typ in enumerate(self.types)}
+        self.masters = {}
+        self.automaton = None
+        self.first_charsets = None
+        self.candidates = {}
+        self.pattern_candidates = {}
+        if CACHE_DIRECTORY is None:
+            self.set_literals()
+        elif not self.load_compiled(CACHE_DIRECTORY):
+            self.set_literals()
+            try:
+                self.save_compiled(CACHE_DIRECTORY)
+            except OSError:
+                pass # an unwritable cache must not prevent to make the language
+
+    def set_literals(self, literals=None):
+        """The literal variants are found by their length then by their string."""
+        if literals is None:
+            literals = {}
+            for index, (typ, elem) in enumerate(self.variants):
+                literal = get_literal(elem.pattern, elem.flags)
+                if literal is not None:
+                    by_string = literals.setdefault(len(literal), {})
+                    by_string[literal] = by_string.get(literal, ()) + (index,)
+        self.literals = literals
+        self.literal_indexes = set(index for by_string in self.literals.values()
+                                   for indexes in by_string.values() for index in indexes)
+
+    def get_signature(self):
+        """Return a hash of the definitions and wrong types, used to find the language in a cache.
+
+        Two languages with the same name but other definitions or wrong types
+        lex differently, so they must not share a lexer or a cached result.
+        """
+        key = repr((CACHE_VERSION, sys.version_info[:2], self.name,
+                    [(typ, elem.pattern, elem.flags) for typ, elem in self.variants], sorted(self.wrong)))
+        import hashlib # only needed with a cache, not imported with weyland
+        return hashlib.sha256(key.encode('utf8')).hexdigest()
+
+    def get_compiled(self):
+        """Return the compiled form of the language, made of built-in types only.
+
+        It holds the literals, the first characters of each variant and the
+        tables of the automaton, None if the automaton cannot be made.
+        """
+        if self.first_charsets is None:
+            self.first_charsets = [get_first_charsets(elem.pattern, elem.flags) for typ, elem in self.variants]
+        try:
+            tables = self.get_automaton().get_tables()
+        except AutomatonException:
+            tables = None
+        return {
+            'signature': self.get_signature(),
+            'literals': self.literals,
+            'first_charsets': self.first_charsets,
+            'candidates': self.candidates,
+            'automaton': tables,
+        }
+
+    def set_compiled(self, compiled):
+        if compiled['signature'] != self.get_signature():
+            raise Exception(f"The compiled form is not the one of the language {self.name}")
+        self.set_literals(compiled['literals'])
+        self.first_charsets = compiled['first_charsets']
+        self.candidates = compiled['candidates']
+        if compiled['automaton'] is not None:
+            self.automaton = Automaton.from_tables(self.variants, compiled['automaton'])
+
+    def get_cache_path(self, directory):
+        return os.path.join(directory, self.get_signature() + '.wyc')
+
+    def save_compiled(self, directory):
+        """Save the compiled form of the language in the directory."""
+        os.makedirs(directory, exist_ok=True)
+        path = self.get_cache_path(directory)
+        temporary = f'{path}.{os.getpid()}'
+        with open(temporary, mode='wb') as f:
+            marshal.dump(self.get_compiled(), f)
+        os.replace(temporary, path)
+
+    def load_compiled(self, directory):
+        """Load the compiled form of the language from the directory. Return False if not found."""
+        try:
+            with open(self.get_cache_path(directory), mode='rb') as f:
+                compiled = marshal.load(f)
+            self.set_compiled(compiled)
+        except (OSError, EOFError, ValueError, TypeError, KeyError):
+            return False
+        return True
+
+    def get_variants(self):
+        """Return the list of (type, variant) in definition order."""
+        return self.variants
+
+    def get_types(self):
+        return self.types
+
+    def get_type_id(self, typ):
+        return self.type_ids[typ]
+
+    def get_candidates(self, c):
+        """Return the indexes of the variants which can match a word starting with c.
+
+        The first characters of each variant are computed once, the result is
+        stored for each character.
+        """
+        if c not in self.candidates:
+            if self.first_charsets is None:
+                self.first_charsets = [get_first_charsets(elem.pattern, elem.flags) for typ, elem in self.variants]
+            self.candidates[c] = tuple(index for index, charsets in enumerate(self.first_charsets)
+                                       if charsets is None or any(charset_contains(charset, c) for charset in charsets))
+        return self.candidates[c]
+
+    def get_pattern_candidates(self, c):
+        """Return the indexes of the candidates for c which are not literals."""
+        if c not in self.pattern_candidates:
+            self.pattern_candidates[c] = tuple(index for index in self.get_candidates(c)
+                                               if index not in self.literal_indexes)
+        return self.pattern_candidates[c]
+
+    def get_literal_matches(self, word):
+        """Return the indexes of the literal variants equal to word."""
+        by_string = self.literals.get(len(word))
+        if by_string is None:
+            return ()
+        return by_string.get(word, ())
+
+    def get_master_regex(self, c=None):
+        """Return the variants compiled in one alternation of named groups.
+
+        The alternation follows the definition order, so when it is applied with
+        fullmatch the first group to match is the first defined variant. The
+        group _n is the variant n of get_variants. If c is given, only the
+        candidates for a word starting with c are in the alternation. Return
+        None if there is no candidate.
+        """
+        indexes = tuple(range(len(self.variants))) if c is None else self.get_candidates(c)
+        if indexes not in self.masters:
+            alternatives = [f'(?P<_{index}>{self.get_alternative(index)})' for index in indexes]
+            self.masters[indexes] = re.compile('|'.join(alternatives)) if len(alternatives) > 0 else None
+        return self.masters[indexes]
+
+    def get_alternative(self, index):
+        """Return the source of the variant index for a master regex, with its flags scoped."""
+        elem = self.variants[index][1]
+        source = elem.pattern
+        # No anchor needed, the regex is always applied between bounds
+        if source.startswith('^'):
+            source = source[1:]
+        flags = ''.join(letter for letter, flag in Language.SCOPED_FLAGS if elem.flags & flag)
+        if flags:
+            source = f'(?{flags}:{source})'
+        return source
+
+    def get_automaton(self):
+        """Return all the variants compiled in one minimized DFA."""
+        if self.automaton is None:
+            self.automaton = Automaton(self.variants)
+        return self.automaton
 
     def is_wrong(self, typ):
         return typ in self.wrong
@@ -81,13 +258,129 @@ class Language:
             total += len(v)
         return total
 
+    def analyze(self, sample=None, strict=False):
+        """Return an Analysis of the cost of the patterns.
+
+        Each variant is checked for catastrophic backtracking and for words
+        which can always grow, making the lexer read to the end of the text.
+        If sample is given, it is lexed with the simple engine to measure the
+        seconds of each variant per character. If strict, an exception is
+        raised when a problem is found.
+        """
+        analysis = Analysis(self)
+        for index, (typ, elem) in enumerate(self.variants):
+            for kind, message in get_backtracking(elem.pattern, elem.flags):
+                analysis.add(index, kind, message)
+            try:
+                if len(Automaton([(typ, elem)]).get_unbounded_states()) > 0:
+                    analysis.add(index, 'unbounded', 'A word can always grow: the lexer reads until the end of the text')
+            except AutomatonException as e:
+                analysis.add(index, 'automaton', f'Not handled by the automaton, the lexer looks one character ahead: {e}')
+        counts = [len(self.get_pattern_candidates(chr(code))) for code in range(32, 127)]
+        analysis.candidates = sum(counts) / len(counts)
+        if sample is not None and len(sample) > 0:
+            from weyland.lexer import Lexer, LexerStats # lexer imports languages
+            stats = LexerStats()
+            lexer = Lexer(self, [])
+            lexer.set_stats(stats)
+            lexer.lex(sample)
+            analysis.costs = {index: seconds / len(sample) for index, seconds in stats.attempt_seconds.items()}
+        if strict and len(analysis.problems) > 0:
+            raise Exception(f"Slow definitions in language {self.name}:\n{analysis}")
+        return analysis
+
     def __str__(self):
         return f"Language {self.get_name()} with {self.get_number_of_types()} types and {self.get_number_of_regex()} regex"
 
+
+class Analysis:
+    """Result of Language.analyze.
+
+    problems are (variant index, kind, message), kind is exponential,
+    polynomial, unbounded or automaton. candidates is the average number of
+    regex matched for a word starting with an ASCII character, costs gives
+    for each variant the seconds spent per character of the sample.
+    """
+
+    def __init__(self, lang):
+        self.lang = lang
+        self.problems = []
+        self.candidates = 0.0
+        self.costs = {}
+
+    def add(self, index, kind, message):
+        self.problems.append((index, kind, message))
+
+    def get_problems(self, kind=None):
+        return [problem for problem in self.problems if kind is None or problem[1] == kind]
+
+    def __str__(self):
+        variants = self.lang.get_variants()
+        lines = []
+        for index, kind, message in self.problems:
+            typ, elem = variants[index]
+            lines.append(f"{typ:20s} {elem.pattern!r:35s} {kind:12s} {message}")
+        lines.append(f"Regex matched for a word: {self.candidates:.1f} in average")
+        for index in sorted(self.costs, key=self.costs.get, reverse=True):
+            typ, elem = variants[index]
+            lines.append(f"{typ:20s} {elem.pattern!r:35s} {self.costs[index] * 1e9:8.1f} ns per character")
+        return '\n'.join(lines)
+
+class LanguageRegistry(MutableMapping):
+    """Dictionary of languages made on their first access from a function without parameter."""
+
+    def __init__(self, factories=None):
+        self.factories = {}
+        self.languages = {}
+        if factories is not None:
+            self.update(factories)
+
+    def __getitem__(self, name):
+        if name not in self.languages:
+            self.languages[name] = self.factories[name]()
+        return self.languages[name]
+
+    def __setitem__(self, name, value):
+        """Value is a Language or a function returning one."""
+        self.languages.pop(name, None)
+        if isinstance(value, Language):
+            self.languages[name] = value
+            self.factories[name] = lambda: value
+        else:
+            self.factories[name] = value
+
+    def __delitem__(self, name):
+        del self.factories[name]
+        self.languages.pop(name, None)
+
+    def __contains__(self, name):
+        """Test the name without making the language, False for an unhashable name."""
+        try:
+            return name in self.factories
+        except TypeError:
+            return False
+
+    def __iter__(self):
+        return iter(self.factories)
+
+    def __len__(self):
+        return len(self.factories)
+
+    def is_loaded(self, name):
+        return name in self.languages
+
+    def __repr__(self):
+        return f"LanguageRegistry({list(self.factories)})"
+
 #-------------------------------------------------------------------------------
 # Globals and constants
 #-------------------------------------------------------------------------------
 
+# Version of the compiled form of the languages
+CACHE_VERSION = 1
+# Directory of the compiled languages, None for no cache
+CACHE_DIRECTORY = os.environ.get('WEYLAND_CACHE_DIRECTORY')
+
 # Shared definitions
 IDENTIFIER   = ['[@_]&*']
 WRONG_INT    = ['[123456789]#*@&*', '0[aAbCdDeEfFgGhHiIjJkKlLmMnNoOpPqQrRsStTuUvVwWyYzZ]#*@&*', '00#*@&*']
@@ -111,11 +404,12 @@ PATTERNS = {
     'WRONG_INTEGER' : ['\\d+\\w+'],
     'BLANKS'        : ['[ \\t]+'],
     'NEWLINES'      : ['\n', '\n\r', '\r\n'],
-    'STRINGS'       : ["'([^\\\\]|\\\\['nt])*'", '"([^\\\\]|\\\\["nt])*"'],
+    'STRINGS'       : ["'([^'\\\\]|\\\\['nt\\\\])*'", '"([^"\\\\]|\\\\["nt\\\\])*"'],
 }
 
-LANGUAGES = {
-    'ash': Language('ash',
+# Built-in languages, each one is made on its first use
+LANGUAGES = LanguageRegistry({
+    'ash': lambda: Language('ash',
         {
             'keyword'   : [ 'if', 'then', 'else', 'end', 'elif'],
             'boolean'   : ['true', 'false'],
@@ -137,7 +431,7 @@ LANGUAGES = {
             'ante_identifier': ['function'],
         }
     ),
-    'game': Language('game',
+    'game': lambda: Language('game',
         {
             'number': ['\\d+'],
             'normal': ['\\w[\\w\'-]*'], # Total Annihilation => 2 tokens, Baldur's => 1, Half-life => 1
@@ -147,7 +441,7 @@ LANGUAGES = {
             'operator': [':'] # FarCry:
         }
     ),
-    'lua': Language('lua',
+    'lua': lambda: Language('lua',
         {
             'keyword': ['and', 'break', 'do', 'else', 'elseif', 'end', 'for',
                         'function', 'goto', 'if', 'in', 'local', 'not', 'or',
@@ -176,7 +470,7 @@ LANGUAGES = {
             'ante_identifier': ['function'],
         }
     ),
-    'python': Language('python',
+    'python': lambda: Language('python',
         {
             'keyword' : ['await', 'else', 'import', 'pass', 'break', 'except', 'in',
                      'raise', 'class', 'finally', 'is', 'return', 'and', 'for',
@@ -200,14 +494,14 @@ LANGUAGES = {
             'wrong_int' : PATTERNS["WRONG_INTEGER"],
         }
     ),
-    'text': Language('text',
+    'text': lambda: Language('text',
         {
             'normal': ['[^\\t\\n]*'],
             'blank': PATTERNS['BLANKS'],
             'newline': PATTERNS['NEWLINES'],
         }
     ),
-    'hamill' : Language('hamill',
+    'hamill' : lambda: Language('hamill',
         {
             'keyword': ['var', 'const', 'include', 'require', 'css', 'html'],
             'boolean': ['true', 'false'],
@@ -223,6 +517,6 @@ LANGUAGES = {
             'line_comment': ['§§'],
         },
     )
-}
+})
 
 RECOGNIZED_LANGUAGES = LANGUAGES.keys()
@@ -31,8 +31,16 @@
 #-------------------------------------------------------------------------------
 
 from weyland.languages import Language, LANGUAGES, PATTERNS
-import html
+from weyland.automaton import AutomatonException, DEAD
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import chain, repeat
+import io
+import mmap
+import os
 import re
+import time
 
 #-------------------------------------------------------------------------------
 # Functions
@@ -41,6 +49,137 @@ import re
 def ln(s):
     return s.replace('\n', '<NL>')
 
+def get_source(text):
+    """Return what the values of the tokens are sliced from: a memoryview for bytes or mmap, to slice without copy."""
+    if not isinstance(text, str):
+        return memoryview(text)
+    return text
+
+
+def encode_varint(buffer, number):
+    """Append number to buffer, a bytearray, 7 bits by byte, the last byte without its high bit."""
+    while number > 0x7F:
+        buffer.append((number & 0x7F) | 0x80)
+        number >>= 7
+    buffer.append(number)
+
+def decode_varint(data, pos):
+    """Return the number encoded at pos in data and the position after it."""
+    number = data[pos]
+    if number < 0x80:
+        return number, pos + 1
+    number = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, pos
+        shift += 7
+
+
+def bisect_start(tokens, start, lo=0):
+    """Return the index of the first token starting at start or after."""
+    hi = len(tokens)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if tokens[mid].start < start:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def lex_chunk(lexer, text, offset, eof):
+    """Lex a chunk of a text in a worker process.
+
+    Return the starts, ends and variant indexes of the tokens and the position
+    where the lexing stopped: the end of the chunk, the start of a token
+    needing the next chunk or the start of a text which cannot be lexed.
+    """
+    starts = array('I')
+    ends = array('I')
+    indexes = array('H')
+    start = 0
+    while start < len(text):
+        try:
+            found = lexer.find(text, start, eof)
+        except LexingException:
+            break
+        if found is None:
+            break
+        starts.append(offset + start)
+        ends.append(offset + found[0])
+        indexes.append(found[1])
+        start = found[0]
+    return starts, ends, indexes, offset + start
+
+def get_worker_lexer(language, discards, engine):
+    """Return the lexer of a worker for a language (a name or a Language), made once."""
+    # Two languages can have the same name, not the same definitions
+    name = language if isinstance(language, str) else language.get_signature()
+    key = (name, tuple(discards), engine)
+    if key not in WORKER_LEXERS:
+        lang = LANGUAGES[language] if isinstance(language, str) else language
+        WORKER_LEXERS[key] = Lexer(lang, list(discards), engine)
+    return WORKER_LEXERS[key]
+
+
+def work_batch(language, discards, engine, html, raws, documents):
+    lexer = get_worker_lexer(language, discards, engine)
+    if html:
+        return [lexer.to_html(text=document, raws=raws) for document in documents]
+    return [lexer.lex(document) for document in documents]
+
+
+def iter_many(documents, language, discards, engine, html, raws, workers, executor, threads, size):
+    """Yield (index of the document, result) for batches of documents, as they are completed."""
+    documents = list(documents)
+    workers = os.cpu_count() if workers is None else workers
+    if size is None:
+        size = max(1, len(documents) // (workers * 4))
+    batches = [documents[index:index + size] for index in range(0, len(documents), size)]
+    # Imported here: concurrent.futures brings multiprocessing and logging, too slow to import for all
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+    own = executor is None
+    if own:
+        executor = ThreadPoolExecutor(workers) if threads else ProcessPoolExecutor(workers)
+    try:
+        futures = {executor.submit(work_batch, language, discards, engine, html, raws, batch): number * size
+                   for number, batch in enumerate(batches)}
+        for future in as_completed(futures):
+            for index, result in enumerate(future.result()):
+                yield futures[future] + index, result
+    finally:
+        if own:
+            executor.shutdown()
+
+
+def lex_many(documents, language, discards=None, engine='simple', workers=None, executor=None,
+             threads=False, ordered=True, size=None):
+    """Lex many documents in a pool of processes, or threads.
+
+    language is a name of LANGUAGES or a Language. The documents are sent by
+    batches of size documents and each worker makes only one lexer by
+    language. Return the list of the tokens of each document if ordered,
+    else an iterator of (index of the document, tokens) as they are lexed.
+    """
+    discards = [] if discards is None else discards
+    results = iter_many(documents, language, discards, engine, False, None, workers, executor, threads, size)
+    if not ordered:
+        return results
+    return [result for index, result in sorted(results, key=lambda pair: pair[0])]
+
+
+def to_html_many(documents, language, raws=None, engine='simple', workers=None, executor=None,
+                 threads=False, ordered=True, size=None):
+    """Like lex_many but return the html of each document, as to_html."""
+    raws = [] if raws is None else raws
+    results = iter_many(documents, language, [], engine, True, raws, workers, executor, threads, size)
+    if not ordered:
+        return results
+    return [result for index, result in sorted(results, key=lambda pair: pair[0])]
+
 #-------------------------------------------------------------------------------
 # Classes
 #-------------------------------------------------------------------------------
@@ -49,12 +188,65 @@ class LexingException(Exception):
     pass
 
 
+class LexingLimitException(LexingException):
+    """A limit of the lexer is exceeded.
+
+    limit is size, token, seconds or evaluations, tokens are the tokens found
+    before and position is where the lexing stopped.
+    """
+
+    def __init__(self, message, limit, tokens=None, position=0):
+        super().__init__(message)
+        self.limit = limit
+        self.tokens = tokens
+        self.position = position
+
+
+class LexingBudget:
+    """The evaluations and the time left to one lexing, None for no limit.
+
+    One is made for each call of lex with limits and given to find, so the
+    lexings of the same lexer in several threads are counted apart. The time
+    is checked at each word matched and every STEP characters read by the
+    automaton, so a single long token is stopped too.
+    """
+
+    STEP = 4096
+
+    def __init__(self, evaluations=None, seconds=None):
+        self.count = 0
+        self.evaluations = evaluations
+        self.seconds = seconds
+        self.deadline = None if seconds is None else time.perf_counter() + seconds
+
+    def add(self, count=1):
+        self.count += count
+        if self.evaluations is not None and self.count > self.evaluations:
+            raise LexingLimitException(f"More than {self.evaluations} evaluations", 'evaluations')
+        self.check_time()
+
+    def check_time(self):
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise LexingLimitException(f"Lexing longer than {self.seconds} seconds", 'seconds')
+
+    def count_matcher(self, matcher):
+        def counted(end):
+            self.add()
+            return matcher(end)
+        return counted
+
+
 class Token:
+
+    # line and col are set only by Lexer.lex_positions or LineIndex.set_positions
+    __slots__ = ('typ', 'value', 'start', 'line', 'col')
     
-    def __init__(self, typ, value, start):
+    def __init__(self, typ, value, start, line=None, col=None):
         self.typ = typ
         self.value = value
         self.start = start
+        self.line = line
+        self.col = col
 
     def get_type(self):
         return self.typ
@@ -65,6 +257,12 @@ class Token:
     def get_start(self):
         return self.start
 
+    def get_line(self):
+        return self.line
+
+    def get_col(self):
+        return self.col
+
     def __eq__(self, o):
         if type(o) != Token:
             return False
@@ -80,186 +278,1244 @@ class Token:
         return f"Token {self.typ:20s}  |{(ln(self.value) + '|'):10s}  {len(self.value)} @{self.start}"
 
 
-class Mini:
+class TokenView:
+    """A token made only of its type and its bounds in the text.
+
+    Its value is sliced from the text when it is asked for: a str for a str
+    text, a memoryview for a bytes text.
+    """
+
+    __slots__ = ('typ', 'text', 'start', 'end')
 
-    def __init__(self, typ, elem, start):
+    def __init__(self, typ, text, start, end):
         self.typ = typ
-        self.elem = elem
+        self.text = text
         self.start = start
+        self.end = end
+
+    def get_type(self):
+        return self.typ
+
+    def get_value(self):
+        return self.text[self.start:self.end]
+
+    def get_start(self):
+        return self.start
+
+    def get_end(self):
+        return self.end
+
+    def to_token(self):
+        return Token(self.typ, self.get_value(), self.start)
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"<{self.typ}@{self.start}:{self.end}>"
+
+
+class TokenArray:
+    """Tokens stored by columns: type ids, starts and ends.
+
+    The values are sliced from the text only when they are asked for.
+    """
+
+    def __init__(self, text, types):
+        self.text = get_source(text)
+        self.types = types
+        self.ids = array('H')
+        self.starts = array('I')
+        self.ends = array('I')
+
+    def append(self, typ_id, start, end):
+        self.ids.append(typ_id)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def get_type(self, index):
+        return self.types[self.ids[index]]
+
+    def get_value(self, index):
+        return self.text[self.starts[index]:self.ends[index]]
+
+    def get_start(self, index):
+        return self.starts[index]
+
+    def get_end(self, index):
+        return self.ends[index]
+
+    def to_tokens(self):
+        return list(self)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        return Token(self.get_type(index), self.get_value(index), self.starts[index])
+
+    def __iter__(self):
+        for index in range(len(self.ids)):
+            yield self[index]
+
+    def __repr__(self):
+        return f"<TokenArray of {len(self)} tokens>"
+
+
+class CharOffsets:
+    """Map the byte offsets of an UTF-8 text (bytes or mmap) to character offsets.
+
+    The characters are counted once by blocks, then inside a block when an
+    offset is asked for. An offset inside a character gives the next one.
+    """
+
+    # An UTF-8 character starts with any byte but these
+    CONTINUATIONS = bytes(range(0x80, 0xC0))
+
+    def __init__(self, data, block=65536):
+        self.data = data
+        self.block = block
+        self.counts = array('Q', [0])
+        for start in range(0, len(data), block):
+            self.counts.append(self.counts[-1] + self.count(start, min(start + block, len(data))))
+
+    def count(self, start, end):
+        """Return the number of characters starting between the byte offsets start and end."""
+        return len(bytes(self.data[start:end]).translate(None, CharOffsets.CONTINUATIONS))
+
+    def get(self, offset):
+        """Return the character offset of the byte offset."""
+        block = offset // self.block
+        return self.counts[block] + self.count(block * self.block, offset)
+
+
+class LineIndex:
+    """The starts of the lines of a text (str, bytes or mmap), to convert offsets to (line, column).
+
+    Lines and columns start at 1. A line ends after its \\n, the columns of a
+    bytes text are counted in bytes.
+    """
+
+    def __init__(self, text):
+        newline = '\n' if isinstance(text, str) else b'\n'
+        self.length = len(text)
+        self.starts = array('Q', [0])
+        end = text.find(newline)
+        while end != -1:
+            self.starts.append(end + 1)
+            end = text.find(newline, end + 1)
+
+    def get_line_count(self):
+        return len(self.starts)
+
+    def get_line_start(self, line):
+        return self.starts[line - 1]
+
+    def get_line_end(self, line):
+        """Return the offset after the last character of the line, its \\n included."""
+        return self.starts[line] if line < len(self.starts) else self.length
+
+    def get_position(self, offset):
+        """Return the (line, column) of the offset."""
+        line = bisect_right(self.starts, offset)
+        return line, offset - self.starts[line - 1] + 1
+
+    def get_offset(self, line, col):
+        return self.starts[line - 1] + col - 1
+
+    def set_positions(self, tokens):
+        """Set the line and col of the tokens, in the order of their starts, and return them."""
+        starts = self.starts
+        line = 1
+        first = 0
+        following = starts[1] if len(starts) > 1 else self.length + 1
+        for tok in tokens:
+            start = tok.start
+            if start >= following:
+                line = bisect_right(starts, start, line)
+                first = starts[line - 1]
+                following = starts[line] if line < len(starts) else self.length + 1
+            tok.line = line
+            tok.col = start - first + 1
+        return tokens
+
+    def get_tokens(self, tokens, first, last):
+        """Return the tokens on the lines first to last, with the token starting before and ending on first."""
+        start = self.get_line_start(first)
+        lo = bisect_start(tokens, start)
+        if lo > 0 and tokens[lo - 1].start + len(tokens[lo - 1].value) > start:
+            lo -= 1
+        return tokens[lo:bisect_start(tokens, self.get_line_end(last), lo)]
+
+
+class LexerStats:
+    """Statistics of a lexer, recorded only when given to Lexer.set_stats.
+
+    By type: the number of tokens found, their characters (bytes for a bytes
+    text) and the seconds spent to find them. By variant index, for the
+    simple engine: the number of fullmatch and their seconds. Override
+    record to get a callback for each token found.
+    """
+
+    def __init__(self):
+        self.tokens = {}
+        self.characters = {}
+        self.seconds = {}
+        self.attempts = {}
+        self.attempt_seconds = {}
+
+    def record(self, typ, start, end, seconds):
+        self.tokens[typ] = self.tokens.get(typ, 0) + 1
+        self.characters[typ] = self.characters.get(typ, 0) + end - start
+        self.seconds[typ] = self.seconds.get(typ, 0.0) + seconds
+
+    def record_attempt(self, index, seconds):
+        self.attempts[index] = self.attempts.get(index, 0) + 1
+        self.attempt_seconds[index] = self.attempt_seconds.get(index, 0.0) + seconds
+
+    def get_total_characters(self):
+        return sum(self.characters.values())
+
+    def get_total_seconds(self):
+        return sum(self.seconds.values())
+
+    def report(self, lang):
+        """Return the statistics as a text, the most costly first."""
+        lines = [f"{'type':20s} {'tokens':>10s} {'characters':>12s} {'seconds':>10s}"]
+        for typ in sorted(self.seconds, key=self.seconds.get, reverse=True):
+            lines.append(f"{typ:20s} {self.tokens[typ]:10d} {self.characters[typ]:12d} {self.seconds[typ]:10.4f}")
+        if len(self.attempts) > 0:
+            lines.append(f"{'type':20s} {'pattern':30s} {'attempts':>10s} {'seconds':>10s}")
+            variants = lang.get_variants()
+            for index in sorted(self.attempt_seconds, key=self.attempt_seconds.get, reverse=True):
+                typ, elem = variants[index]
+                lines.append(f"{typ:20s} {ln(elem.pattern)[:30]:30s} {self.attempts[index]:10d} {self.attempt_seconds[index]:10.4f}")
+        return '\n'.join(lines)
+
+
+class LexerCache:
+    """Results of lex and to_html, kept when given to Lexer.set_cache.
+
+    A result is found by the signature of the language, the discards (raws
+    for to_html), the limits of the lexer and a hash of the text. At most
+    entries results and results of texts of at most characters characters in
+    all are kept in memory, the least recently used are evicted first. With
+    a directory, the evicted results are written there (tokens as token
+    streams) and read back in memory when asked for again, flush writes them
+    all. At most disk_bytes bytes of files are kept in the directory, the
+    least recently used are removed first.
+    """
+
+    def __init__(self, entries=1024, characters=None, directory=None, disk_bytes=None):
+        import hashlib # only needed with a cache, not imported with weyland
+        self.hash = hashlib.blake2b
+        self.entries = entries
+        self.characters = characters
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self.results = OrderedDict()
+        self.files = OrderedDict()
+        self.disk_size = 0
+        self.weight = 0
+        self.signatures = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            # The files of the previous runs, the oldest first
+            entries = [entry for entry in os.scandir(directory) if entry.name.endswith(('.wyt', '.html'))]
+            for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+                self.files[entry.path] = entry.stat().st_size
+                self.disk_size += self.files[entry.path]
+
+    def get_key(self, operation, lexer, options, text):
+        lang = lexer.get_language()
+        if lang not in self.signatures:
+            self.signatures[lang] = lang.get_signature()
+        limits = None if lexer.limits is None else tuple(lexer.limits.values())
+        data = text.encode('utf8') if isinstance(text, str) else text
+        return (operation, self.signatures[lang], tuple(options), limits, isinstance(text, str),
+                self.hash(data, digest_size=16).hexdigest())
+
+    def get_path(self, key):
+        name = self.hash(repr(key).encode('utf8'), digest_size=16).hexdigest()
+        return os.path.join(self.directory, name + ('.wyt' if key[0] == 'lex' else '.html'))
+
+    def get(self, key, lexer, weight=0):
+        """Return the result of key, None if it is not kept.
+
+        A result read from the directory is kept in memory again, with weight.
+        """
+        if key in self.results:
+            self.results.move_to_end(key)
+            self.hits += 1
+            return self.results[key][0]
+        if self.directory is not None:
+            path = self.get_path(key)
+            try:
+                if key[0] == 'lex':
+                    with open(path, mode='rb') as f:
+                        result = list(lexer.read_stream(f))
+                else:
+                    with open(path, mode='r', encoding='utf8', newline='') as f:
+                        result = f.read()
+            except (OSError, LexingException):
+                pass
+            else:
+                self.hits += 1
+                self.disk_hits += 1
+                if path in self.files:
+                    self.files.move_to_end(path)
+                self.put(key, result, weight, lexer)
+                return result
+        self.misses += 1
+        return None
+
+    def put(self, key, result, weight, lexer):
+        self.results[key] = (result, weight, lexer)
+        self.weight += weight
+        while len(self.results) > self.entries or (self.characters is not None and self.weight > self.characters):
+            key, (result, weight, lexer) = self.results.popitem(last=False)
+            self.weight -= weight
+            self.evictions += 1
+            if self.directory is not None:
+                self.save(key, result, lexer)
+
+    def save(self, key, result, lexer):
+        path = self.get_path(key)
+        temporary = f'{path}.{os.getpid()}'
+        if key[0] == 'lex':
+            with open(temporary, mode='wb') as f:
+                lexer.write_stream(f, tokens=result)
+        else:
+            with open(temporary, mode='w', encoding='utf8', newline='') as f:
+                f.write(result)
+        os.replace(temporary, path)
+        self.disk_size -= self.files.pop(path, 0)
+        self.files[path] = os.path.getsize(path)
+        self.disk_size += self.files[path]
+        while self.disk_bytes is not None and self.disk_size > self.disk_bytes:
+            path, size = self.files.popitem(last=False)
+            self.disk_size -= size
+            self.disk_evictions += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def flush(self):
+        """Write all the results kept in memory in the directory."""
+        for key, (result, weight, lexer) in self.results.items():
+            self.save(key, result, lexer)
+
+    def clear(self):
+        self.results.clear()
+        self.weight = 0
+
+    def get_hits(self):
+        return self.hits
+
+    def get_misses(self):
+        return self.misses
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return (f"<LexerCache of {len(self)} results, {self.hits} hits ({self.disk_hits} from disk), "
+                f"{self.misses} misses, {self.evictions} evictions ({self.disk_evictions} from disk)>")
 
 
 class Lexer:
 
-    def __init__(self, lang, discards=[]):
+    # simple : each pattern is fullmatched against the words, from the longest which can be a token
+    # regex  : one alternation of all the patterns is fullmatched against the words, the same way
+    # dfa    : all the patterns are compiled into one DFA, walked one character at a time
+    ENGINES = ['simple', 'regex', 'dfa']
+
+    def __init__(self, lang, discards=[], engine='simple'):
+        if engine not in Lexer.ENGINES:
+            raise LexingException(f"Unknown engine {engine}. Engines are: {', '.join(Lexer.ENGINES)}")
         self.lang = lang
         self.discards = discards
+        self.engine = engine
+        # The automaton tells when a word cannot grow into a token anymore
+        try:
+            self.automaton = lang.get_automaton()
+        except AutomatonException:
+            if engine == 'dfa':
+                raise
+            self.automaton = None
+        # Without automaton, find_vision reads two characters after a token
+        self.lookahead = 2 if self.automaton is None else self.automaton.get_lookahead()
+        self.stats = None
+        self.limits = None
+        self.cache = None
 
     def get_language(self):
         return self.lang
 
-    def match(self, start, word, debug=False):
-        matches = []
-        for typ, variants in self.lang.get_type_definitions():
-            for elem in variants:
-                m = elem.fullmatch(word)
-                if m is not None:
-                    if debug:
-                        print(f"    Match: {typ} : {elem} => {m}")
-                    matches.append(Mini(typ, elem, start))
-        return matches
+    def set_stats(self, stats=None):
+        """Record the statistics of the lexing in stats, a LexerStats, or stop if None.
+
+        The instrumented methods replace find and match_indexes on this lexer
+        only, without stats nothing is measured. The lexing done by other
+        processes (lex_parallel, lex_many) is not recorded.
+        """
+        self.stats = stats
+        if stats is None:
+            self.__dict__.pop('find', None)
+            self.__dict__.pop('match_indexes', None)
+        else:
+            self.find = self.find_with_stats
+            self.match_indexes = self.match_indexes_with_stats
+
+    def get_stats(self):
+        return self.stats
+
+    def set_cache(self, cache=None):
+        """Keep the results of lex and to_html in cache, a LexerCache, or stop if None.
+
+        Like set_stats, the cached methods replace lex and to_html on this
+        lexer only. Only str and bytes texts are cached.
+        """
+        self.cache = cache
+        if cache is None:
+            self.__dict__.pop('lex', None)
+            self.__dict__.pop('to_html', None)
+        else:
+            self.lex = self.lex_with_cache
+            self.to_html = self.to_html_with_cache
+
+    def get_cache(self):
+        return self.cache
+
+    def set_limits(self, size=None, token=None, seconds=None, evaluations=None, fallback=False):
+        """Limit lex and to_html for untrusted texts, None for no limit.
+
+        size is the maximum length of the text, token the maximum length of a
+        token, seconds the maximum time and evaluations the maximum number of
+        words matched by a regex (characters read for the dfa engine). The
+        time is checked at each word matched and while the automaton reads a
+        token, but a single match of a regex is not interrupted. Exceeding a
+        limit raises a LexingLimitException, or with fallback, the rest of the
+        text is lexed with the text language.
+        """
+        self.limits = {'size': size, 'token': token, 'seconds': seconds, 'evaluations': evaluations,
+                       'fallback': fallback}
+        if all(value is None for value in (size, token, seconds, evaluations)):
+            self.limits = None
+
+    def get_limits(self):
+        return self.limits
+
+    def match_indexes(self, word):
+        """Return the indexes of the variants matching word, in definition order."""
+        variants = self.lang.get_variants()
+        indexes = [index for index in self.lang.get_pattern_candidates(word[0])
+                   if variants[index][1].fullmatch(word) is not None]
+        literals = self.lang.get_literal_matches(word)
+        if len(literals) > 0:
+            indexes = sorted(indexes + list(literals))
+        return indexes
+
+    def match_indexes_with_stats(self, word):
+        variants = self.lang.get_variants()
+        indexes = []
+        for index in self.lang.get_pattern_candidates(word[0]):
+            begin = time.perf_counter()
+            m = variants[index][1].fullmatch(word)
+            self.stats.record_attempt(index, time.perf_counter() - begin)
+            if m is not None:
+                indexes.append(index)
+        literals = self.lang.get_literal_matches(word)
+        if len(literals) > 0:
+            indexes = sorted(indexes + list(literals))
+        return indexes
 
     def lex(self, text, discards=None, debug=False):
         discards = self.discards if discards is None else discards
-        word = ''
-        old = None
-        matched = []
+        if self.limits is None:
+            tokens = self.lex_with_find(text, discards)
+        else:
+            tokens = self.lex_with_limits(text, discards)
+        if debug:
+            for token in tokens:
+                print('token emis: ' + repr(token))
+        return tokens
+
+    def lex_with_cache(self, text, discards=None, debug=False):
+        discards = self.discards if discards is None else discards
+        if not isinstance(text, (str, bytes)):
+            return Lexer.lex(self, text, discards, debug)
+        key = self.cache.get_key('lex', self, discards, text)
+        tokens = self.cache.get(key, self, len(text))
+        if tokens is None:
+            tokens = Lexer.lex(self, text, discards, debug)
+            self.cache.put(key, tokens, len(text), self)
+        return list(tokens)
+
+    def find(self, text, start, eof=True, stop=None, budget=None):
+        """Find the token starting at start in text.
+
+        The token is the longest word matching a variant. If several variants
+        match it, the first defined wins. The automaton of the language finds
+        where the word cannot grow into a token anymore, then the simple and
+        regex engines match the words from there downward.
+        Return (end, index of the variant) or None if eof is False and the end
+        of text, or stop, is reached before the token is known.
+        The words matched, or the characters read by the dfa engine, are
+        counted in budget if given, a LexingBudget, which checks the time too.
+        A text of bytes (bytes, bytearray, mmap) is decoded one word at a
+        time and matched by the master regex, whatever the engine.
+        """
+        stop = len(text) if stop is None else stop
+        binary = not isinstance(text, str)
+        if self.engine == 'dfa' and not binary:
+            found = self.find_dfa(text, start, eof, stop, budget)
+            if budget is not None and found is not None:
+                budget.add(found[0] - start + 1)
+            return found
+        elif binary:
+            matcher = self.get_byte_matcher(text, start)
+        elif self.engine == 'regex':
+            matcher = self.get_regex_matcher(text, start)
+        else:
+            matcher = self.get_simple_matcher(text, start)
+        if budget is not None:
+            matcher = budget.count_matcher(matcher)
+        if self.automaton is None:
+            return self.find_vision(text, start, eof, stop, matcher)
+        limit = self.get_byte_limit(text, start, stop, budget) if binary else self.get_limit(text, start, stop, budget)
+        if limit is None:
+            if not eof:
+                return None
+            limit = stop
+        for end in range(limit, start, -1):
+            if binary and end < len(text) and text[end] & 0xC0 == 0x80:
+                continue # inside an UTF-8 character
+            index = matcher(end)
+            if index is not None:
+                return end, index
+        return self.found(text, start, True, start, None)
+
+    def find_with_stats(self, text, start, eof=True, stop=None, budget=None):
+        begin = time.perf_counter()
+        found = Lexer.find(self, text, start, eof, stop, budget)
+        if found is not None:
+            self.stats.record(self.lang.get_variants()[found[1]][0], start, found[0], time.perf_counter() - begin)
+        return found
+
+    def get_simple_matcher(self, text, start):
+        def matcher(end):
+            matched = self.match_indexes(text[start:end])
+            return matched[0] if len(matched) > 0 else None
+        return matcher
+
+    def get_regex_matcher(self, text, start):
+        return self.get_master_matcher(text, start, self.lang.get_master_regex(text[start]))
+
+    def get_byte_matcher(self, text, start):
+        # A word of UTF-8 bytes is decoded and matched as a str, so a character of several bytes is one unit
+        b = text[start]
+        size = 1 if b < 0xC0 else 2 if b < 0xE0 else 3 if b < 0xF0 else 4
+        try:
+            master = self.lang.get_master_regex(bytes(text[start:start + size]).decode('utf8'))
+        except UnicodeDecodeError:
+            master = None
+        if master is None:
+            return lambda end: None
+        fullmatch = master.fullmatch
+        def matcher(end):
+            try:
+                m = fullmatch(bytes(text[start:end]).decode('utf8'))
+            except UnicodeDecodeError:
+                return None
+            return None if m is None else int(m.lastgroup[1:])
+        return matcher
+
+    @staticmethod
+    def get_master_matcher(text, start, master):
+        if master is None:
+            return lambda end: None
+        fullmatch = master.fullmatch
+        def matcher(end):
+            m = fullmatch(text, start, end)
+            return None if m is None else int(m.lastgroup[1:])
+        return matcher
+
+    def get_limit(self, text, start, stop, budget=None):
+        """Return the end of the longest word from start which can still grow into a token.
+
+        Return None if stop is reached before: the word could grow further.
+        The time of budget is checked every LexingBudget.STEP characters.
+        """
+        automaton = self.automaton
+        table = automaton.table
+        classes = automaton.classes
+        state = automaton.start
+        end = start
+        while end < stop:
+            step = stop if budget is None else min(stop, end + LexingBudget.STEP)
+            while end < step:
+                c = text[end]
+                state = table[state][classes[c] if c in classes else automaton.classify(c)]
+                if state == DEAD:
+                    return end
+                end += 1
+            if budget is not None:
+                budget.check_time()
+        return None
+
+    def get_byte_limit(self, text, start, stop, budget=None):
+        """Same as get_limit for a text of bytes, decoded one UTF-8 character at a time."""
+        automaton = self.automaton
+        table = automaton.table
+        state = automaton.start
+        end = start
+        while end < stop:
+            step = stop if budget is None else min(stop, end + LexingBudget.STEP)
+            while end < step:
+                b = text[end]
+                size = 1 if b < 0xC0 else 2 if b < 0xE0 else 3 if b < 0xF0 else 4
+                if end + size > stop:
+                    return None
+                c = chr(b) if b < 0x80 else bytes(text[end:end + size]).decode('utf8', 'replace')[0]
+                state = table[state][automaton.classify(c)]
+                if state == DEAD:
+                    return end
+                end += size
+            if budget is not None:
+                budget.check_time()
+        return None
+
+    def walk(self, state, text, start):
+        """Return the state of the automaton after reading text from start, DEAD if it dies."""
+        automaton = self.automaton
+        table = automaton.table
+        classes = automaton.classes
+        for end in range(start, len(text)):
+            c = text[end]
+            state = table[state][classes[c] if c in classes else automaton.classify(c)]
+            if state == DEAD:
+                return DEAD
+        return state
+
+    def find_vision(self, text, start, eof, stop, matcher):
+        # Without automaton, a word grows while it matches or while the word
+        # with one more character (not byte) matches: the vision of the future
+        binary = not isinstance(text, str)
+        last = None
+        last_end = start
+        last_step = 0
+        step = 0
+        end = start
+        while end < stop:
+            end += 1
+            while binary and end < stop and text[end] & 0xC0 == 0x80:
+                end += 1
+            step += 1
+            index = matcher(end)
+            if index is not None:
+                last = index
+                last_end = end
+                last_step = step
+            elif last is not None and step - last_step >= 2:
+                return last_end, last
+        return self.found(text, start, eof, last_end, last)
+
+    def find_dfa(self, text, start, eof, stop, budget=None):
+        # The word grows until the automaton is dead, the last accepting state gives the token
+        automaton = self.automaton
+        table = automaton.table
+        accepts = automaton.accepts
+        classes = automaton.classes
+        state = automaton.start
+        last = None
+        last_end = start
+        end = start
+        while end < stop:
+            step = stop if budget is None else min(stop, end + LexingBudget.STEP)
+            while end < step:
+                c = text[end]
+                state = table[state][classes[c] if c in classes else automaton.classify(c)]
+                if state == DEAD:
+                    return self.found(text, start, True, last_end, last)
+                end += 1
+                if accepts[state] is not None:
+                    last = accepts[state]
+                    last_end = end
+            if budget is not None:
+                budget.check_time()
+        return self.found(text, start, eof, last_end, last)
+
+    def found(self, text, start, eof, end, index):
+        if not eof:
+            return None
+        if index is None and not isinstance(text, str):
+            raise LexingException(f'Bytes not lexed at {start}: {bytes(text[start:start + 40])!r} for {self.lang}')
+        elif index is None:
+            raise LexingException(f'Text not lexed at the end: |{text[start:]}| in |{ln(text)}| for {self.lang}')
+        return end, index
+
+    def make_token(self, text, start, found, discards):
+        end, index = found
+        typ, elem = self.lang.get_variants()[index]
+        content = text[start:end]
+        if self.lang.is_wrong(typ):
+            raise LexingException(f'A wrong token definition {typ} : {elem} has been validated by the lexer: {content}')
+        if typ in discards:
+            return None
+        return Token(typ, content, start)
+
+    def lex_with_find(self, text, discards):
         tokens = []
         start = 0
-        i = 0
-        while i < len(text):
-            word += text[i]
-            if debug:
-                print(f"{i}. @{start} |{ln(word)}|")
-            matched = self.match(start, word, debug)
-            if debug and len(matched) == 0:
-                print('    no match this turn')
-            if len(matched) == 0 and (old is None or len(old) == 0):
-                # Nothing, we try to add the maximum
-                pass
-            elif len(matched) == 0: # old is not None and old.length > 0
-                # Visions: trying to see if there is something after
-                if i + 1 < len(text):
-                    future_index = i + 1
-                    future_word = word + text[future_index]
-                    matched = self.match(start, future_word, debug)
-                    if debug and len(matched) > 0:
-                        print('    vision of the future OK')
-                # Si et seulement si dans le futur on n'aura rien on fait un jeton, sinon on continue
-                if len(matched) == 0:
-                    content = word[0:len(word)-1]
-                    if debug:
-                        print(f'pour le mot |{content}| nous avons :')
-                        for res in old:
-                            print(f"    {res.typ} : {res.elem} @{res.start}")
-                    if self.lang.is_wrong(old[0].typ):
-                       raise LexingException(f'A wrong token definition {old[0].typ} : {old[0].elem} has been validated by the lexer: {content}')
-                    if old[0].typ not in discards:
-                        tokens.append(Token(old[0].typ, content, old[0].start))
-                        if debug:
-                            print('token emis: ' + repr(tokens[-1]))
-                    word = ''
-                    start = i
-                    i -= 1
-            old = matched
-            matched =[]
-            i += 1
-        if len(old) > 0:
-            content = word
-            if debug:
-                print('pour le mot ' + content + ' nous avons :')
-                for res in old:
-                    print(f'    {res.typ} : {res.elem}')
-            if self.lang.is_wrong(old[0].typ):
-                raise LexingException(f'A wrong token definition {old[0].typ} : {old[0].elem} has been validated by the lexer: {content}')
-            if old[0].typ not in discards:
-                tokens.append(Token(old[0].typ, content, old[0].start))
-                if debug:
-                    print('token emis: ' + repr(tokens[-1]))
-        elif len(word) > 0:
-            raise LexingException(f'Text not lexed at the end: |{word}| in |{ln(text)}| for {self.lang}')
+        while start < len(text):
+            found = self.find(text, start)
+            token = self.make_token(text, start, found, discards)
+            if token is not None:
+                tokens.append(token)
+            start = found[0]
         return tokens
 
+    def iter_spans(self, text, discards=None):
+        """Yield the tokens of text as (type, start, end), without their values."""
+        discards = self.discards if discards is None else discards
+        variants = self.lang.get_variants()
+        start = 0
+        while start < len(text):
+            end, index = self.find(text, start)
+            typ = variants[index][0]
+            if self.lang.is_wrong(typ):
+                raise LexingException(f'A wrong token definition {typ} : {variants[index][1]} has been validated by the lexer: {text[start:end]}')
+            if typ not in discards:
+                yield typ, start, end
+            start = end
+
+    def lex_views(self, text, discards=None):
+        """Lex text into a list of TokenView, whose values are sliced from text on demand."""
+        source = get_source(text)
+        return [TokenView(typ, source, start, end) for typ, start, end in self.iter_spans(text, discards)]
+
+    def lex_positions(self, text, discards=None):
+        """Lex text into tokens with their line and col set. Return the tokens and the LineIndex of text."""
+        index = LineIndex(text)
+        return index.set_positions(self.lex(text, discards)), index
+
+    def lex_with_limits(self, text, discards):
+        limits = self.limits
+        tokens = []
+        start = 0
+        # Counted for this call only, the lexer can be shared between threads
+        budget = None
+        if limits['evaluations'] is not None or limits['seconds'] is not None:
+            budget = LexingBudget(limits['evaluations'], limits['seconds'])
+        try:
+            if limits['size'] is not None and len(text) > limits['size']:
+                raise LexingLimitException(f"Text of {len(text)} characters, more than {limits['size']}", 'size')
+            while start < len(text):
+                # A token is too long if the word can still grow after the maximum length
+                stop = len(text) if limits['token'] is None else min(len(text), start + limits['token'] + 1)
+                found = self.find(text, start, stop == len(text), stop, budget)
+                if found is None:
+                    raise LexingLimitException(f"Token longer than {limits['token']} characters", 'token')
+                token = self.make_token(text, start, found, discards)
+                if token is not None:
+                    tokens.append(token)
+                start = found[0]
+                if budget is not None:
+                    budget.check_time()
+        except LexingLimitException as e:
+            e.tokens = tokens
+            e.position = start
+            if not limits['fallback']:
+                raise
+            fallback = Lexer(LANGUAGES['text'], discards, 'dfa')
+            tokens.extend(Token(tok.typ, tok.value, tok.start + start) for tok in fallback.lex(text[start:]))
+        return tokens
+
+    def lex_array(self, text, discards=None):
+        """Lex text into a TokenArray."""
+        discards = self.discards if discards is None else discards
+        types = self.lang.get_types()
+        variants = self.lang.get_variants()
+        ids = [self.lang.get_type_id(typ) for typ, elem in variants]
+        tokens = TokenArray(text, types)
+        start = 0
+        while start < len(text):
+            end, index = self.find(text, start)
+            typ = variants[index][0]
+            if self.lang.is_wrong(typ):
+                raise LexingException(f'A wrong token definition {typ} : {variants[index][1]} has been validated by the lexer: {text[start:end]}')
+            if typ not in discards:
+                tokens.append(ids[index], start, end)
+            start = end
+        return tokens
+
+    def lex_parallel(self, text, workers=None, discards=None, executor=None):
+        """Lex text in chunks in several processes.
+
+        The text is cut after new lines. A chunk may start inside a token (a
+        string or a multiline comment): its tokens are used only from the
+        first one starting where the previous chunks end a token. Before that,
+        the text is lexed again here, one token at a time.
+        """
+        discards = self.discards if discards is None else discards
+        workers = os.cpu_count() if workers is None else workers
+        bounds = [0]
+        for number in range(1, workers):
+            cut = text.find('\n', len(text) * number // workers)
+            if cut != -1 and cut + 1 > bounds[-1] and cut + 1 < len(text):
+                bounds.append(cut + 1)
+        bounds.append(len(text))
+        chunks = [text[bounds[index]:bounds[index + 1]] for index in range(len(bounds) - 1)]
+        eofs = [index == len(chunks) - 1 for index in range(len(chunks))]
+        if executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(workers) as executor:
+                results = list(executor.map(lex_chunk, repeat(self), chunks, bounds, eofs))
+        else:
+            results = list(executor.map(lex_chunk, repeat(self), chunks, bounds, eofs))
+        # Stitch the chunks
+        variants = self.lang.get_variants()
+        tokens = []
+        start = 0
+        for starts, ends, indexes, stop in results + [(array('I'), array('I'), array('H'), len(text))]:
+            first = 0
+            while start < stop:
+                while first < len(starts) and starts[first] < start:
+                    first += 1
+                if first < len(starts) and starts[first] == start:
+                    break
+                found = self.find(text, start)
+                token = self.make_token(text, start, found, discards)
+                if token is not None:
+                    tokens.append(token)
+                start = found[0]
+            else:
+                continue
+            for index in range(first, len(starts)):
+                typ, elem = variants[indexes[index]]
+                value = text[starts[index]:ends[index]]
+                if self.lang.is_wrong(typ):
+                    raise LexingException(f'A wrong token definition {typ} : {elem} has been validated by the lexer: {value}')
+                if typ not in discards:
+                    tokens.append(Token(typ, value, starts[index]))
+            start = stop
+        return tokens
+
+    def relex(self, text, tokens, offset, deleted, inserted, discards=None):
+        """Update the tokens of a text after an edit and return the new tokens.
+
+        text is the text after the edit: deleted characters were removed at
+        offset and inserted was inserted at the same place. The text is lexed
+        again from the last token before which no token, discarded or not,
+        looked at the edited characters, until a token starts at the same
+        place as an old one. The following old tokens are shifted, not lexed
+        again. If the lookahead of the language is unbounded, the text is
+        lexed again from its start.
+        """
+        discards = self.discards if discards is None else discards
+        delta = len(inserted) - deleted
+        # A token ending at most lookahead characters before the edit did not read it
+        first = -1 if self.lookahead is None else bisect_start(tokens, offset - self.lookahead + 1) - 1
+        start = tokens[first].start if first >= 0 else 0
+        result = tokens[:first] if first >= 0 else []
+        # Lex until a token starts where an old token started
+        last = bisect_start(tokens, offset + deleted)
+        while start < len(text):
+            if start >= offset + len(inserted):
+                last = bisect_start(tokens, start - delta, last)
+                if last < len(tokens) and tokens[last].start == start - delta:
+                    if delta == 0:
+                        result.extend(tokens[last:])
+                    else:
+                        result.extend(Token(tok.typ, tok.value, tok.start + delta) for tok in tokens[last:])
+                    return result
+            found = self.find(text, start)
+            token = self.make_token(text, start, found, discards)
+            if token is not None:
+                result.append(token)
+            start = found[0]
+        return result
+
+    def iter_tokens(self, source, discards=None, size=65536):
+        """Yield the tokens of source, a string, a text file or an iterable of strings.
+
+        Only the text of the current token is kept between two reads, a token
+        can span several chunks.
+        """
+        discards = self.discards if discards is None else discards
+        if isinstance(source, str):
+            chunks = iter([source])
+        elif hasattr(source, 'read'):
+            chunks = iter(lambda: source.read(size), '')
+        else:
+            chunks = iter(source)
+        buffer = ''
+        offset = 0 # offset of buffer in the source
+        start = 0
+        eof = False
+        while not eof or start < len(buffer):
+            found = self.find(buffer, start, eof) if start < len(buffer) else None
+            if found is None and start < len(buffer) and self.automaton is not None:
+                # The token needs the next chunks: only they are read by the
+                # automaton until it is dead, the token is found once after
+                parts = [buffer[start:]]
+                state = self.walk(self.automaton.start, buffer, start)
+                while state != DEAD:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        eof = True
+                        break
+                    parts.append(chunk)
+                    state = self.walk(state, chunk, 0)
+                buffer = ''.join(parts)
+                offset += start
+                start = 0
+                continue
+            elif found is None:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    eof = True
+                else:
+                    buffer = buffer[start:] + chunk
+                    offset += start
+                    start = 0
+                continue
+            token = self.make_token(buffer, start, found, discards)
+            if token is not None:
+                token.start += offset
+                yield token
+            start = found[0]
+
     def to_html(self, text=None, tokens=None, raws=None):
+        return ''.join(self.iter_html(text, tokens, raws))
+
+    def to_html_with_cache(self, text=None, tokens=None, raws=None):
+        raws = [] if raws is None else raws
+        if not isinstance(text, str) or tokens is not None:
+            return Lexer.to_html(self, text, tokens, raws)
+        key = self.cache.get_key('html', self, raws, text)
+        html = self.cache.get(key, self, len(text))
+        if html is None:
+            html = Lexer.to_html(self, text, tokens, raws)
+            self.cache.put(key, html, len(text), self)
+        return html
+
+    def iter_html(self, text=None, tokens=None, raws=None):
+        """Yield the html of each token.
+
+        text can be a string, a text file or an iterable of strings, it is
+        lexed while the html is made. tokens can be any iterable of tokens.
+        """
         raws = [] if raws is None else raws
         if text is None and tokens is None:
             raise LexingException("Nothing send to to_html")
         elif text is not None and tokens is not None:
             raise LexingException("Send to to_html text OR tokens, not both!")
-        if text is not None:
+        if text is not None and self.limits is not None:
+            if not isinstance(text, str):
+                text = text.read() if hasattr(text, 'read') else ''.join(text)
             tokens = self.lex(text, [])
-        output = ''
+        elif text is not None:
+            tokens = self.iter_tokens(text, [])
+        prefixes = {}
         for tok in tokens:
-            if tok.get_type() in raws:
-                output += tok.get_value()
+            typ = tok.get_type()
+            if typ in raws:
+                yield tok.get_value()
             else:
-                val = tok.get_value()
-                val = val.replace('&', '&amp;')
-                val = val.replace('>', '&gt;')
-                val = val.replace('<', '&lt;')
-                val = val.replace('"', '&quot;')
-                val = val.replace("'", '&#x27;')
-                output += f'<span class="{self.lang.get_name()}-{tok.get_type()}">{val}</span>'
-        return output
+                if typ not in prefixes:
+                    prefixes[typ] = f'<span class="{self.lang.get_name()}-{typ}">'
+                yield prefixes[typ] + tok.get_value().translate(HTML_ESCAPES) + '</span>'
 
+    def write_html(self, output, text=None, tokens=None, raws=None, size=1024):
+        """Write the html of the tokens in output, a text file, by groups of size tokens."""
+        parts = []
+        for part in self.iter_html(text, tokens, raws):
+            parts.append(part)
+            if len(parts) >= size:
+                output.write(''.join(parts))
+                parts = []
+        output.write(''.join(parts))
+
+    def iter_stream(self, text=None, tokens=None, lexemes=True):
+        """Yield the token stream of TOKEN_STREAM_MAGIC as bytes: the header, then groups of tokens."""
+        if text is None and tokens is None:
+            raise LexingException("Nothing send to iter_stream")
+        elif text is not None and tokens is not None:
+            raise LexingException("Send to iter_stream text OR tokens, not both!")
+        binary = isinstance(text, (bytes, bytearray, memoryview, mmap.mmap))
+        if tokens is not None:
+            # The values of the first token tell if the text was bytes
+            tokens = iter(tokens)
+            first = next(tokens, None)
+            if first is not None:
+                binary = not isinstance(first.get_value(), str)
+                tokens = chain([first], tokens)
+        elif binary:
+            source = get_source(text)
+            tokens = (TokenView(typ, source, start, end) for typ, start, end in self.iter_spans(text, []))
+        else:
+            tokens = self.iter_tokens(text, [])
+        types = self.lang.get_types()
+        header = bytearray(TOKEN_STREAM_MAGIC)
+        header.append(TOKEN_STREAM_VERSION)
+        header.append((TOKEN_STREAM_LEXEMES if lexemes else 0) | (TOKEN_STREAM_BYTES if binary else 0))
+        for name in [self.lang.get_name()] + types:
+            name = name.encode('utf8')
+            encode_varint(header, len(name))
+            header.extend(name)
+        encode_varint(header, 0) # end of the type table
+        yield bytes(header)
+        ids = {typ: number + 1 for number, typ in enumerate(types)}
+        buffer = bytearray()
+        end = 0
+        for tok in tokens:
+            value = tok.get_value()
+            start = tok.get_start()
+            if start < end:
+                raise LexingException(f"Token {tok!r} starts before the end of the previous one at {end}")
+            encode_varint(buffer, ids[tok.get_type()])
+            encode_varint(buffer, start - end)
+            encode_varint(buffer, len(value))
+            end = start + len(value)
+            if lexemes:
+                value = value.encode('utf8') if isinstance(value, str) else bytes(value)
+                encode_varint(buffer, len(value))
+                buffer.extend(value)
+            if len(buffer) >= 65536:
+                yield bytes(buffer)
+                buffer.clear()
+        buffer.append(0) # end of the tokens
+        yield bytes(buffer)
+
+    def to_stream(self, text=None, tokens=None, lexemes=True):
+        return b''.join(self.iter_stream(text, tokens, lexemes))
+
+    def write_stream(self, output, text=None, tokens=None, lexemes=True):
+        """Write the token stream of the tokens in output, a binary file."""
+        for part in self.iter_stream(text, tokens, lexemes):
+            output.write(part)
+
+    def read_stream(self, stream, text=None, size=65536):
+        """Yield the tokens of a token stream, a binary file or bytes, read by chunks of size.
+
+        Without the lexemes in the stream, their values are sliced from text,
+        the lexed text. The stream must have been made for the language of
+        this lexer.
+        """
+        if not hasattr(stream, 'read'):
+            stream = io.BytesIO(stream)
+        data = b''
+        pos = 0
+        def fill(count):
+            # Keep at least count bytes to read after pos, unless the stream ends
+            nonlocal data, pos
+            while len(data) - pos < count:
+                chunk = stream.read(size)
+                if not chunk:
+                    return
+                data = data[pos:] + chunk
+                pos = 0
+        try:
+            fill(6)
+            if data[pos:pos + 4] != TOKEN_STREAM_MAGIC or data[pos + 4] != TOKEN_STREAM_VERSION:
+                raise LexingException(f"Not a token stream of version {TOKEN_STREAM_VERSION}")
+            flags = data[pos + 5]
+            pos += 6
+            names = []
+            while True:
+                fill(10)
+                length, pos = decode_varint(data, pos)
+                if length == 0:
+                    break
+                fill(length)
+                names.append(data[pos:pos + length].decode('utf8'))
+                pos += length
+            name, types = names[0], [None] + names[1:]
+            if name != self.lang.get_name():
+                raise LexingException(f"Token stream of {name}, not of {self.lang.get_name()}")
+            lexemes = flags & TOKEN_STREAM_LEXEMES
+            binary = flags & TOKEN_STREAM_BYTES
+            if not lexemes and text is None:
+                raise LexingException("The token stream has no lexemes, the text is needed")
+            source = get_source(text) if text is not None else None
+            end = 0
+            while True:
+                if len(data) - pos < 40:
+                    fill(40)
+                typ, pos = decode_varint(data, pos)
+                if typ == 0:
+                    return
+                gap, pos = decode_varint(data, pos)
+                length, pos = decode_varint(data, pos)
+                start = end + gap
+                end = start + length
+                if lexemes:
+                    count, pos = decode_varint(data, pos)
+                    if len(data) - pos < count:
+                        fill(count)
+                        if len(data) - pos < count:
+                            raise IndexError
+                    value = data[pos:pos + count]
+                    pos += count
+                    if not binary:
+                        value = value.decode('utf8')
+                elif binary:
+                    value = bytes(source[start:end])
+                else:
+                    value = text[start:end]
+                yield Token(types[typ], value, start)
+        except IndexError:
+            raise LexingException("Token stream truncated")
 
-class Test:
 
-    def __init__(self, lexer, text, result):
+class LineLexer:
+    """Lex a text line by line for an editor, keeping the state at the start of each line.
+
+    The state at the start of a line is None if a token starts there, else the
+    token in progress: the line and column of its start and end and its
+    variant index, like an intermediate_comment in Lua. A line is lexed from
+    its state only. The states are computed once, up to the last line asked
+    for, with the furthest line read to compute them: an edit keeps the
+    states computed without reading the edited lines. Lines start at 1, the
+    tokens of a line are cut to the line and their start is in the line.
+    """
+
+    def __init__(self, lexer, text=''):
         self.lexer = lexer
-        self.text = text
-        self.result = result
-        if self.result is None:
-            raise Exception(f"No expected results for test {text}")
-
-    def test(self, num=0, debug=False):
-        tokens = self.lexer.lex(self.text, None, debug)
-        if len(tokens) != len(self.result):
-            longuest = max(len(tokens), len(self.result))
-            print("index expected        type            valeur")
-            for index in range(longuest):
-                if index < len(tokens) and index < len(self.result):
-                    print(f"{index:5d} {self.result[index]:15s} {tokens[index].get_type():15s} {ln(tokens[index].get_value())}")
-                elif index < len(tokens):
-                    print(f"{index:5d} None            {tokens[index].get_type():15s} {ln(tokens[index].get_value())}")
-                elif index < len(self.result):
-                    print(index, self.result[index], 'None')
-            raise Exception(f"Error: expected {len(self.result)} tokens and got {len(tokens)}")
-        for index, r in enumerate(self.result):
-            if tokens[index].get_type() != r:
-                raise LexingException(f"Error: expected {r} and got {tokens[index].get_type()} in {self.text}")
-        print(f"[SUCCESS] Test n°{num} Lang : {self.lexer.get_language()}\nText : |{ln(self.text)}|\nResult:")
-        for tok in tokens:
-            print(f'   {tok}')
+        parts = text.split('\n')
+        self.lines = [part + '\n' for part in parts[:-1]] + [parts[-1]]
+        self.states = [None]
+        self.horizons = [-1] # the furthest line read to compute each state
+
+    def get_line_count(self):
+        return len(self.lines)
+
+    def get_line(self, line):
+        return self.lines[line - 1]
+
+    def get_text(self):
+        return ''.join(self.lines)
+
+    def replace_lines(self, first, last, lines):
+        """Replace the lines first to last by lines, a list of strings all ending with \\n but the last line of the text."""
+        self.lines[first - 1:last] = lines
+        valid = bisect_right(self.horizons, first - 2, 0, min(len(self.states), first))
+        del self.states[max(1, valid):]
+        del self.horizons[max(1, valid):]
+
+    def get_state(self, line):
+        """Return the token in progress at the start of the line as (type, line, col) of its start, None if there is none."""
+        self.compute(line - 1)
+        state = self.states[line - 1]
+        if state is None:
+            return None
+        return self.lexer.lang.get_variants()[state[4]][0], state[0] + 1, state[1] + 1
+
+    def lex_line(self, line):
+        return self.lex_lines(line, line)[0]
+
+    def lex_lines(self, first, last):
+        """Return the list of the tokens of each line from first to last, at most the last line of the text.
+
+        Raise a LexingException if first is not a line of the text.
+        """
+        self.compute(first - 1)
+        variants = self.lexer.lang.get_variants()
+        discards = self.lexer.discards
+        result = []
+        for i in range(first - 1, min(last, len(self.lines))):
+            tokens = []
+            for index, start, end in self.scan(i):
+                typ = variants[index][0]
+                if typ not in discards:
+                    tokens.append(Token(typ, self.lines[i][start:end], start, i + 1, start + 1))
+            result.append(tokens)
+        return result
+
+    def compute(self, i):
+        # Lex the lines after the last known state until the state of line i is known
+        if not 0 <= i < len(self.lines):
+            raise LexingException(f'No line {i + 1} in a text of {len(self.lines)} lines')
+        while len(self.states) <= i:
+            self.scan(len(self.states) - 1)
+
+    def set_state(self, i, state, horizon):
+        if i >= len(self.lines):
+            return
+        if i < len(self.states):
+            self.states[i] = state
+            self.horizons[i] = horizon
+        else:
+            self.states.append(state)
+            self.horizons.append(horizon)
+
+    def scan(self, i):
+        """Return the tokens of line i as (index, start, end) and set the state of the next line."""
+        lines = self.lines
+        line = lines[i]
+        state = self.states[i]
+        horizon = self.horizons[i]
+        if state is not None and state[2] > i:
+            self.set_state(i + 1, state, horizon)
+            return [(state[4], 0, len(line))]
+        spans = []
+        col = 0
+        if state is not None:
+            spans.append((state[4], 0, state[3]))
+            col = state[3]
+        text = line
+        window = 1
+        while col < len(line):
+            found = self.lexer.find(text, col, i + window >= len(lines))
+            if found is None:
+                window *= 2
+                text = ''.join(lines[i:i + window])
+                continue
+            horizon = max(horizon, min(i + window, len(lines)) - 1)
+            end, index = found
+            typ, elem = self.lexer.lang.get_variants()[index]
+            if self.lexer.lang.is_wrong(typ):
+                raise LexingException(f'A wrong token definition {typ} : {elem} has been validated by the lexer: {text[col:end]}')
+            if end <= len(line):
+                spans.append((index, col, end))
+                col = end
+                continue
+            # The token goes on the next lines, each gets it as state
+            end_line = i
+            while end > len(lines[end_line]):
+                end -= len(lines[end_line])
+                end_line += 1
+            spans.append((index, col, len(line)))
+            state = (i, col, end_line, end, index)
+            for following in range(i + 1, end_line + 1):
+                self.set_state(following, state, horizon)
+            return spans
+        self.set_state(i + 1, None, horizon)
+        return spans
 
 #-------------------------------------------------------------------------------
 # Globals and constants
 #-------------------------------------------------------------------------------
 
-lex_lua = Lexer(LANGUAGES['lua'], ['blank'])
-lex_ash = Lexer(LANGUAGES['ash'], ['blank'])
-
-TESTS = [
-    Test(lex_lua, '3+5', ['number', 'operator', 'number']),
-    Test(lex_lua, 'a = 5', ['identifier', 'operator', 'number']),
-    Test(lex_lua, 't = { ["k1"] = 5 }', ['identifier', 'operator', 'separator', 'separator', 'string', 'separator', 'operator', 'number', 'separator']),
-    Test(lex_lua, 't = { ["k1"] = 5, ["k2"] = "v", [4] = 6 } -- Définition\nprint(t["k1"]) -- Accès\nprint(t.k1) -- Accès avec sucre syntaxique',
-            ['identifier', 'operator', 'separator', 'separator', 'string', 'separator', 'operator', 'number', 'separator',
-             'separator', 'string', 'separator', 'operator', 'string', 'separator', 'separator', 'number', 'separator', 'operator', 'number',
-             'separator', 'comment', 'special', 'separator', 'identifier', 'separator', 'string', 'separator', 'separator', 'comment',
-             'special', 'separator', 'identifier', 'operator', 'identifier', 'separator', 'comment']),
-    Test(lex_lua, '--[[Ceci est un\nz--]]', ['comment']),
-    Test(lex_lua, '--[[Ceci est un\ncommentaire multiligne--]]', ['comment']),
-    Test(lex_ash, '2..3', ['number', 'operator', 'number']),
-    Test(lex_ash, 'a = 5', ['identifier', 'operator', 'number'])
-]
-
-#TESTS = [Test(lex, '3+5', ['number', 'operator', 'number']),]
-
-def tests(debug=False):
-    ok = 0
-    for index, t in enumerate(TESTS):
-        try:
-            t.test(index + 1, debug)
-            ok += 1
-        except Exception as e:
-            print(e)
-    print('-----------------------------')
-    print(f'SUCCESS: {ok:5d}')
-    print(f'FAILED:  {(len(TESTS)-ok):5d}')
-
-if __name__ == '__main__':
-    print(Token('number', 5, 0) == Token('number', 5, 0)) # True
-    print(Token('number', 5, 0) != Token('number', 5, 1)) # True
-    print(Token('number', 5, 0) == Token('number', 5, 1)) # False
-    print(repr(Token('number', 5, 0)))
-    tests(True)
+HTML_ESCAPES = str.maketrans({'&': '&amp;', '>': '&gt;', '<': '&lt;', '"': '&quot;', "'": '&#x27;'})
+
+# Token stream: TOKEN_STREAM_MAGIC, the version and the flags on one byte each,
+# the names of the language and of its types (a varint length and UTF-8), a 0,
+# then for each token the varint type id (from 1), distance from the end of the
+# previous token, length in characters (bytes for a bytes text) and with the
+# lexemes flag, the length of its UTF-8 value then the value. A 0 ends it.
+TOKEN_STREAM_MAGIC = b'WLTS'
+TOKEN_STREAM_VERSION = 1
+TOKEN_STREAM_LEXEMES = 1
+TOKEN_STREAM_BYTES = 2
+
+# Lexers made once by each worker of lex_many and to_html_many
+WORKER_LEXERS = {}
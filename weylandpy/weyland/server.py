@@ -0,0 +1,252 @@
+# -----------------------------------------------------------
+# MIT Licence (Expat License Wording)
+# -----------------------------------------------------------
+# Copyright © 2020, Damien Gouteux
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# For more information about my projects see:
+# https://xitog.github.io/dgx (in French)
+
+"""Server: lex and to_html over HTTP/JSON, with a warm pool of lexers
+
+python -m weyland.server [--host localhost] [--port 7000] [--workers N] [--threads]
+
+POST /lex     {"lang": "lua", "text": "...", "id": 1, "discards": [], "engine": "dfa"}
+           -> {"id": 1, "lang": "lua", "tokens": [[type, value, start], ...]}
+POST /to_html {"lang": "lua", "text": "...", "id": 1, "raws": [], "engine": "dfa"}
+           -> {"id": 1, "lang": "lua", "result": "<span ..."}
+GET  /languages -> {"languages": ["ash", ...]}
+
+An error gives {"error": true, "message": "..."} with the HTTP status.
+"""
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from weyland.languages import LANGUAGES
+from weyland.lexer import Lexer, LexingException, get_worker_lexer
+
+#-------------------------------------------------------------------------------
+# Functions
+#-------------------------------------------------------------------------------
+
+def work(language, discards, engine, html, raws, text):
+    """Lex text in a worker, with its lexer made once, and return what is sent as JSON.
+
+    The lexers are not made for the discards of the clients, which could make
+    as many lexers as they want: the discards are given to lex.
+    """
+    lexer = get_worker_lexer(language, (), engine)
+    if html:
+        return lexer.to_html(text=text, raws=raws)
+    return [[tok.typ, tok.value, tok.start] for tok in lexer.lex(text, list(discards))]
+
+#-------------------------------------------------------------------------------
+# Classes
+#-------------------------------------------------------------------------------
+
+class ServerException(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Server:
+    """Answer the requests with the lexers kept in the workers of an executor.
+
+    At most workers requests are lexed at the same time, the others wait.
+    When pending requests are already waiting or lexed, the server answers
+    503 at once.
+    """
+
+    STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+              413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+    def __init__(self, host='localhost', port=7000, workers=None, threads=False, pending=64,
+                 max_size=1000000, engine='dfa'):
+        self.host = host
+        self.port = port
+        self.workers = os.cpu_count() if workers is None else workers
+        self.threads = threads
+        self.pending = pending
+        self.max_size = max_size
+        self.engine = engine
+        self.executor = None
+        self.semaphore = None
+        self.waiting = 0
+        self.server = None
+        self.connections = {}
+
+    async def start(self):
+        if self.threads:
+            self.executor = ThreadPoolExecutor(self.workers)
+        else:
+            # Forking a process whose event loop has threads can deadlock the workers
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        self.semaphore = asyncio.Semaphore(self.workers)
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        await self.start()
+        print(f'Server is running on http://{self.host}:{self.port}')
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        self.server.close()
+        for writer in self.connections:
+            writer.close()
+        await asyncio.gather(*self.connections.values(), return_exceptions=True)
+        await self.server.wait_closed()
+        self.executor.shutdown()
+
+    async def handle(self, reader, writer):
+        """Answer the requests of a connection until it is closed."""
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                method, path, version = (lines[0].split(' ') + ['', '', ''])[:3]
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                length = headers.get('content-length', '0')
+                if not length.isdigit():
+                    await self.send(writer, 400, {'error': True, 'message': 'Invalid Content-Length.'}, True)
+                    break
+                length = int(length)
+                if length > self.max_size:
+                    await self.send(writer, 413, {'error': True, 'message': f'Body over {self.max_size} bytes.'}, True)
+                    break
+                body = await reader.readexactly(length) if length > 0 else b''
+                try:
+                    status, answer = 200, await self.answer(method, path, body)
+                except ServerException as e:
+                    status, answer = e.status, {'error': True, 'message': str(e)}
+                except Exception as e:
+                    status, answer = 500, {'error': True, 'message': f'{type(e).__name__}: {e}'}
+                close = headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0'
+                await self.send(writer, status, answer, close)
+                if close:
+                    break
+        finally:
+            del self.connections[writer]
+            writer.close()
+
+    async def answer(self, method, path, body):
+        if path == '/languages':
+            return {'languages': list(LANGUAGES)}
+        if path not in ('/lex', '/to_html'):
+            raise ServerException(404, f'No endpoint {path}.')
+        if method != 'POST':
+            raise ServerException(405, f'Endpoint {path} needs POST.')
+        try:
+            params = json.loads(body.decode('utf8'))
+        except ValueError as e:
+            raise ServerException(400, f'Invalid JSON: {e}')
+        if not isinstance(params, dict):
+            raise ServerException(400, 'The body should be a JSON object.')
+        lang = params.get('lang')
+        text = params.get('text')
+        if lang is None:
+            raise ServerException(400, 'No lang defined.')
+        elif lang not in LANGUAGES:
+            raise ServerException(400, f'Lang {lang} is not handled.')
+        elif not isinstance(text, str):
+            raise ServerException(400, f'No text defined for method {path[1:]}.')
+        engine = params.get('engine', self.engine)
+        if engine not in Lexer.ENGINES:
+            raise ServerException(400, f"Unknown engine {engine}. Engines are: {', '.join(Lexer.ENGINES)}")
+        html = path == '/to_html'
+        for name in ('discards', 'raws'):
+            value = params.get(name, [])
+            if not isinstance(value, list) or not all(isinstance(typ, str) for typ in value):
+                raise ServerException(400, f'{name.capitalize()} should be a list of types.')
+        discards = tuple(params.get('discards', []))
+        raws = params.get('raws', [])
+        result = await self.run(work, lang, discards, engine, html, raws, text)
+        answer = {'id': params.get('id'), 'lang': lang}
+        answer['result' if html else 'tokens'] = result
+        return answer
+
+    async def run(self, function, *args):
+        """Run function in the executor, waiting for a free worker."""
+        if self.waiting >= self.pending:
+            raise ServerException(503, 'Too many requests waiting, retry later.')
+        self.waiting += 1
+        try:
+            async with self.semaphore:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        except LexingException as e:
+            raise ServerException(400, str(e))
+        finally:
+            self.waiting -= 1
+
+    async def send(self, writer, status, answer, close):
+        body = json.dumps(answer).encode('utf8')
+        head = (f'HTTP/1.1 {status} {Server.STATUS[status]}\r\n'
+                f'Content-Type: application/json; charset=utf8\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                + ('Connection: close\r\n' if close else '')
+                + ('Retry-After: 1\r\n' if status == 503 else '')
+                + '\r\n')
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+#-------------------------------------------------------------------------------
+# Main
+#-------------------------------------------------------------------------------
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Lex and to_html over HTTP/JSON')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=7000)
+    parser.add_argument('--workers', type=int, help='number of processes (or threads), default to the number of CPU')
+    parser.add_argument('--threads', action='store_true', help='lex in threads instead of processes')
+    parser.add_argument('--pending', type=int, default=64, help='requests waiting before answering 503')
+    parser.add_argument('--max-size', type=int, default=1000000, help='maximum size of a request body in bytes')
+    parser.add_argument('--engine', default='dfa', choices=Lexer.ENGINES)
+    options = parser.parse_args(args)
+    server = Server(options.host, options.port, options.workers, options.threads, options.pending,
+                    options.max_size, options.engine)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()